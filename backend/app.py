@@ -1,17 +1,71 @@
-from fastapi import FastAPI, UploadFile, HTTPException, Depends, Header
+import time
+# Đo thời gian khởi động tính từ lúc bắt đầu import ứng dụng
+import_started = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, HTTPException, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel 
 from bson import ObjectId
 from typing import List, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime
 import os
-from utils import users_collection, hash_password, verify_password, create_jwt, decode_jwt, save_quiz, quizzes_collection, pinecone_index, embedding_model, pinecone_index, process_and_translate_chat, clean_text
+import json
+import asyncio
+from utils import users_collection, get_user, invalidate_user, user_cache, attempts_collection, quiz_stats_collection, hash_password, verify_and_update_password, password_pool, password_hashing_stats, create_jwt, decode_jwt, save_quiz, quizzes_collection, retriever, job_queue, embed_query, answer_cache, answer_cache_key, query_embedding_cache, ingest_pdf_chat, convert_to_ascii, save_upload, UploadTooLarge, ensure_indexes
 from langchain.prompts import PromptTemplate
-from src.QAGenerator import model
-import unicodedata
+from src.QAGenerator import get_model, estimate_tokens, question_cache
+from src.Compute import compute
+from src.Resources import resources
+from src.Metrics import metrics
+from src.ContextBuilder import ContextBuilder
+from src.PromptConstants import ChatPrompt
+
+resources.record("import_seconds", time.perf_counter() - import_started)
+
+# Tài nguyên nạp sẵn khi khởi động: "" (không nạp), "all" hoặc danh sách tên, vd "embedding_model,gemini_model"
+warmup = os.getenv("WARMUP", "")
+# Chờ warm-up xong mới nhận request, mặc định warm-up chạy nền
+warmup_blocking = os.getenv("WARMUP_BLOCKING", "false").lower() == "true"
+
+async def warm_up_resources(names):
+    started = time.perf_counter()
+    try:
+        await compute.run_blocking(resources.warm_up, names)
+    except Exception as e:
+        print(f"Warm-up lỗi: {e}")
+    resources.record("warmup_seconds", time.perf_counter() - started)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # Tạo index cần thiết cho các truy vấn
+    await ensure_indexes()
+    # Khởi động worker xử lý PDF chạy nền
+    await job_queue.start()
+
+    warmup_task = None
+    if warmup:
+        names = None if warmup == "all" else [name.strip() for name in warmup.split(",") if name.strip()]
+        if warmup_blocking:
+            await warm_up_resources(names)
+        else:
+            warmup_task = asyncio.create_task(warm_up_resources(names))
+
+    resources.record("lifespan_seconds", time.perf_counter() - started)
+    resources.record("startup_seconds", time.perf_counter() - import_started)
+    print(f"Khởi động xong sau {time.perf_counter() - import_started:.2f}s")
+    yield
+    if warmup_task:
+        warmup_task.cancel()
+    await job_queue.stop()
+    compute.shutdown()
+    password_pool.shutdown()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 security = HTTPBearer()
 
@@ -22,10 +76,32 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Đo thời gian mỗi request theo route; mỗi request là một trace chứa các span của pipeline
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    with metrics.trace("request", method=request.method, path=request.url.path) as trace:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Dùng mẫu route ("/api/quizzes/{quiz_name}") để số nhãn không tăng theo tham số
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            trace.attributes.update(route=route, status=status)
+            metrics.observe("http_request_seconds", time.perf_counter() - started, method=request.method, route=route, status=status)
+
+# File upload vượt quá MAX_UPLOAD_SIZE
+@app.exception_handler(UploadTooLarge)
+async def upload_too_large_handler(request, exc: UploadTooLarge):
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
 class User(BaseModel):
     _id: str
     username: str
@@ -47,7 +123,7 @@ class Quiz(BaseModel):
     _id: str
     quiz_name: str
     questions: List[dict]
-    attempts: Optional[List[dict]] = [] # Lưu thông tin về các lần thử quiz của user
+    attempts: Optional[List[dict]] = [] # Không còn dùng: các lần làm quiz lưu trong collection attempts
 
     class Config:
         json_encoders = {
@@ -59,6 +135,14 @@ class Question(BaseModel):
     options: List[str]
     correct_answer: str
 
+# Kích thước trang khi client chỉ truyền cursor after
+quiz_page_size = int(os.getenv("QUIZ_PAGE_SIZE", 50))
+
+QUIZ_SUMMARY_PROJECTION = {
+    "quiz_name": 1,
+    "question_count": {"$size": {"$ifNull": ["$questions", []]}},
+}
+
 class ChatRequest(BaseModel):
     query: str
     pdf: Optional[str]
@@ -79,14 +163,21 @@ def get_current_user(authorization: str = Header(None)):
     
     return user_data
 
+# Document người dùng hiện tại, lấy một lần mỗi request và cache trong thời gian ngắn
+async def get_user_document(current_user=Depends(get_current_user)):
+    user = await get_user(current_user["username"])
+    if not user:
+        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
+    return user
+
 # API đăng ký
 @app.post("/api/register")
 async def register_user(user: User):
-    if users_collection.find_one({"username": user.username}):
+    if await users_collection.find_one({"username": user.username}):
         raise HTTPException(status_code=400, detail="Username đã tồn tại")
 
-    password_hash = hash_password(user.password)
-    users_collection.insert_one({
+    password_hash = await hash_password(user.password)
+    await users_collection.insert_one({
         "username": user.username,
         "password": password_hash,
         "profile": user.profile,
@@ -98,14 +189,20 @@ async def register_user(user: User):
 # API đăng nhập
 @app.post("/api/login")
 async def login_user(user: Login):
-    db_user = users_collection.find_one({"username": user.username})
+    db_user = await users_collection.find_one({"username": user.username})
     
     if not db_user:
         raise HTTPException(status_code=400, detail="Tên người dùng không tồn tại")
 
-    if not verify_password(user.password, db_user["password"]):
+    valid, new_hash = await verify_and_update_password(user.password, db_user["password"])
+    if not valid:
         raise HTTPException(status_code=400, detail="Mật khẩu không chính xác")
 
+    # Hash cũ dùng số vòng khác cấu hình hiện tại: lưu hash mới
+    if new_hash:
+        await users_collection.update_one({"_id": db_user["_id"]}, {"$set": {"password": new_hash}})
+        invalidate_user(user.username)
+
     token = create_jwt({"username": user.username}) 
     
     return {"token": token}
@@ -117,63 +214,73 @@ async def logout():
     return {"message": "Đăng xuất thành công"}
 
 # API lấy danh sách quizzes
-@app.get("/api/quizzes", response_model=List[Quiz])
-async def get_quizzes(current_user=Depends(get_current_user)):
-    # Lấy thông tin người dùng từ cơ sở dữ liệu
-    user = users_collection.find_one({"username": current_user["username"]})
-    
-    # Kiểm tra nếu người dùng không tồn tại
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Lấy danh sách các quiz_id của người dùng
-    quiz_ids = user.get("quizzes", [])
-    
-    # Lọc các quiz từ quizzes_collection dựa trên quiz_id của người dùng
-    all_quizzes = quizzes_collection.find()  # Lấy tất cả các quiz
-    quizzes = [
-        {**quiz, '_id': str(quiz['_id'])}  # Chuyển đổi _id thành chuỗi
-        for quiz in all_quizzes if str(quiz['_id']) in quiz_ids
-    ]
+@app.get("/api/quizzes")
+async def get_quizzes(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    after: Optional[str] = None,
+    summary: bool = False,
+    user=Depends(get_user_document),
+):
+    # Lấy các quiz của người dùng bằng index _id; chỉ phân trang theo _id khi client truyền limit hoặc after
+    if limit is None and after:
+        limit = quiz_page_size
+    id_filter = {"$in": [ObjectId(id_str) for id_str in user.get("quizzes", [])]}
+    if after:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+        id_filter["$gt"] = ObjectId(after)
+
+    # Chế độ tóm tắt chỉ trả về tên, số câu hỏi và điểm lần làm gần nhất
+    projection = QUIZ_SUMMARY_PROJECTION if summary else {"attempts": 0}
+    cursor = quizzes_collection.find({"_id": id_filter}, projection).sort("_id", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    quizzes = await cursor.to_list(length=limit)
+
+    # Điểm lần làm gần nhất lấy từ thống kê của các quiz trong trang
+    if summary and quizzes:
+        stats = quiz_stats_collection.find({"_id": {"$in": [quiz["_id"] for quiz in quizzes]}}, {"last_score": 1})
+        last_scores = {stat["_id"]: stat.get("last_score") async for stat in stats}
+        for quiz in quizzes:
+            quiz["last_score"] = last_scores.get(quiz["_id"])
+
+    quizzes = [{**quiz, '_id': str(quiz['_id'])} for quiz in quizzes]  # Chuyển đổi _id thành chuỗi
+
+    # Còn trang tiếp theo: trả cursor trong header để giữ nguyên định dạng danh sách
+    if limit and len(quizzes) == limit:
+        response.headers["X-Next-Cursor"] = quizzes[-1]["_id"]
     
     return quizzes
 
 # API thêm quiz
 @app.post("/api/quizzes", response_model=Quiz)
-async def create_quiz(quiz: Quiz, current_user=Depends(get_current_user)):
-    # Lấy thông tin người dùng từ cơ sở dữ liệu
-    user = users_collection.find_one({"username": current_user["username"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
+async def create_quiz(quiz: Quiz, user=Depends(get_user_document)):
     # Thêm quiz vào cơ sở dữ liệu
-    result = quizzes_collection.insert_one(quiz.dict())
+    result = await quizzes_collection.insert_one(quiz.dict())
     quiz._id = str(result.inserted_id)
 
     # Thêm quiz mới vào danh sách quizzes của người dùng
-    users_collection.update_one(
-        {"username": current_user["username"]},
+    await users_collection.update_one(
+        {"username": user["username"]},
         {"$push": {"quizzes": quiz._id}}
     )
+    invalidate_user(user["username"])
 
     return quiz
 
 # API sửa quiz
 @app.put("/api/quizzes/{quiz_name}", response_model=Quiz)
-async def update_quiz(quiz_name: str, quiz: Quiz, current_user=Depends(get_current_user)):
-    # Tìm người dùng hiện tại
-    user = users_collection.find_one({"username": current_user["username"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
-    
+async def update_quiz(quiz_name: str, quiz: Quiz, user=Depends(get_user_document)):
     # Giả sử user.get("quizzes", []) trả về danh sách các chuỗi
     quiz_ids = [ObjectId(id_str) for id_str in user.get("quizzes", [])]
 
     # Tìm quiz theo tên quiz và thuộc quyền sở hữu của người dùng
-    existing_quiz = quizzes_collection.find_one({"quiz_name": quiz_name, "_id": {"$in": quiz_ids}})
+    existing_quiz = await quizzes_collection.find_one({"quiz_name": quiz_name, "_id": {"$in": quiz_ids}})
 
     # Cập nhật quiz trong MongoDB
-    quizzes_collection.update_one(
+    await quizzes_collection.update_one(
         {"_id": existing_quiz["_id"]},
         {"$set": {"questions": quiz.questions}}
     )
@@ -184,26 +291,24 @@ async def update_quiz(quiz_name: str, quiz: Quiz, current_user=Depends(get_curre
 
 # API xóa quiz
 @app.delete("/api/quizzes/{quiz_name}")
-async def delete_quiz(quiz_name: str, current_user=Depends(get_current_user)):
-    # Tìm người dùng hiện tại
-    user = users_collection.find_one({"username": current_user["username"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
-    
+async def delete_quiz(quiz_name: str, user=Depends(get_user_document)):
     # Giả sử user.get("quizzes", []) trả về danh sách các chuỗi
     quiz_ids = [ObjectId(id_str) for id_str in user.get("quizzes", [])]
 
     # Tìm quiz theo tên quiz và thuộc quyền sở hữu của người dùng
-    quiz = quizzes_collection.find_one({"quiz_name": quiz_name, "_id": {"$in": quiz_ids}})
+    quiz = await quizzes_collection.find_one({"quiz_name": quiz_name, "_id": {"$in": quiz_ids}})
     
     # Xóa quiz trong MongoDB
-    quizzes_collection.delete_one({"_id": quiz["_id"]})
+    await quizzes_collection.delete_one({"_id": quiz["_id"]})
+    await attempts_collection.delete_many({"quiz_id": quiz["_id"]})
+    await quiz_stats_collection.delete_one({"_id": quiz["_id"]})
     
     # Xóa ID quiz khỏi danh sách `user.quizzes`
-    users_collection.update_one(
-        {"username": current_user["username"]},
+    await users_collection.update_one(
+        {"username": user["username"]},
         {"$pull": {"quizzes": str(quiz["_id"])}}
     )
+    invalidate_user(user["username"])
     
     # Xóa tệp PDF tương ứng trong thư mục static
     file_location = os.path.join("static", f"{quiz_name}.pdf")
@@ -214,17 +319,12 @@ async def delete_quiz(quiz_name: str, current_user=Depends(get_current_user)):
 
 #API xem quiz
 @app.get("/api/quizzes/{quiz_name}")
-async def get_quiz(quiz_name: str, current_user=Depends(get_current_user)):
-    # Tìm người dùng hiện tại
-    user = users_collection.find_one({"username": current_user["username"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
-    
+async def get_quiz(quiz_name: str, user=Depends(get_user_document)):
     # Giả sử user.get("quizzes", []) trả về danh sách các chuỗi
     quiz_ids = [ObjectId(id_str) for id_str in user.get("quizzes", [])]
 
     # Tìm quiz theo tên quiz và thuộc quyền sở hữu của người dùng
-    quiz = quizzes_collection.find_one({"quiz_name": quiz_name, "_id": {"$in": quiz_ids}})
+    quiz = await quizzes_collection.find_one({"quiz_name": quiz_name, "_id": {"$in": quiz_ids}})
 
     quiz["_id"] = str(quiz["_id"])
     quiz["questions"] = quiz["questions"]
@@ -234,250 +334,316 @@ async def get_quiz(quiz_name: str, current_user=Depends(get_current_user)):
 # API gửi bài làm quiz
 @app.post("/api/quizzes/{quiz_name}/attempt")
 async def attempt_quiz(quiz_name: str, answers: List[str], current_user=Depends(get_current_user)):
-    quiz = quizzes_collection.find_one({"quiz_name": quiz_name})
+    quiz = await quizzes_collection.find_one({"quiz_name": quiz_name}, {"questions.answer": 1})
     if not quiz:
         raise HTTPException(status_code=404, detail="Không tìm thấy quiz")
     
     # Tính điểm
     correct_answers = [q["answer"] for q in quiz["questions"]]
-    score = sum(1 for i, ans in enumerate(answers) if ans == correct_answers[i])
-
-    # Lưu kết quả làm quiz
-    attempt = {
+    correct = [i for i, ans in enumerate(answers[:len(correct_answers)]) if ans == correct_answers[i]]
+    score = len(correct)
+
+    # Lưu kết quả làm quiz vào collection riêng, không đẩy vào document quiz
+    now = datetime.utcnow()
+    await attempts_collection.insert_one({
+        "quiz_id": quiz["_id"],
+        "username": current_user["username"],
         "answers": answers,
         "score": score,
-    }
-    quizzes_collection.update_one(
-        {"quiz_name": quiz_name},
-        {"$push": {"attempts": attempt}}
+        "total": len(correct_answers),
+        "time": now,
+    })
+
+    # Cập nhật thống kê cộng dồn để không phải quét lại các lần làm
+    await quiz_stats_collection.update_one(
+        {"_id": quiz["_id"]},
+        {
+            "$inc": {
+                "attempt_count": 1,
+                "total_score": score,
+                **{f"question_correct.{i}": 1 for i in correct},
+            },
+            "$set": {"last_score": score, "last_attempt_at": now, "question_count": len(correct_answers)},
+        },
+        upsert=True
     )
 
     return {"score": score, "total": len(correct_answers), "answers": correct_answers}
 
 # API hiển thị lịch sử làm quiz
 @app.get("/api/quizzes/{quiz_name}/history")
-async def get_quiz_history(quiz_name: str, current_user=Depends(get_current_user)):
-    quiz = quizzes_collection.find_one({"quiz_name": quiz_name})
+async def get_quiz_history(
+    quiz_name: str,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    before: Optional[str] = None,
+    current_user=Depends(get_current_user),
+):
+    quiz = await quizzes_collection.find_one({"quiz_name": quiz_name}, {"_id": 1})
     if not quiz:
         raise HTTPException(status_code=404, detail="Không tìm thấy quiz")
 
+    # Lấy các lần làm mới nhất trước, phân trang theo (time, _id): các lần làm trùng thời gian không bị bỏ sót
+    query = {"quiz_id": quiz["_id"], "username": current_user["username"]}
+    if before:
+        before_time, _, before_id = before.partition("|")
+        try:
+            before_time = datetime.fromisoformat(before_time)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+        if before_id:
+            if not ObjectId.is_valid(before_id):
+                raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+            query["$or"] = [
+                {"time": {"$lt": before_time}},
+                {"time": before_time, "_id": {"$lt": ObjectId(before_id)}},
+            ]
+        else:
+            # Cursor cũ chỉ có thời gian
+            query["time"] = {"$lt": before_time}
+    cursor = attempts_collection.find(query, {"quiz_id": 0}).sort([("time", -1), ("_id", -1)]).limit(limit)
+    attempts = await cursor.to_list(length=limit)
+
     history = [
-        attempt for attempt in quiz.get("attempts", [])
-        if attempt["username"] == current_user["username"]
+        {**{k: v for k, v in attempt.items() if k != "_id"}, "time": attempt["time"].isoformat()}
+        for attempt in attempts
     ]
+    if len(attempts) == limit:
+        response.headers["X-Next-Cursor"] = f"{history[-1]['time']}|{attempts[-1]['_id']}"
     return history
 
+# API thống kê quiz
+@app.get("/api/quizzes/{quiz_name}/stats")
+async def get_quiz_stats(quiz_name: str, current_user=Depends(get_current_user)):
+    quiz = await quizzes_collection.find_one({"quiz_name": quiz_name}, {"_id": 1})
+    if not quiz:
+        raise HTTPException(status_code=404, detail="Không tìm thấy quiz")
+
+    stats = await quiz_stats_collection.find_one({"_id": quiz["_id"]}) or {}
+    attempt_count = stats.get("attempt_count", 0)
+    question_correct = stats.get("question_correct", {})
+
+    return {
+        "attempt_count": attempt_count,
+        "average_score": stats.get("total_score", 0) / attempt_count if attempt_count else None,
+        "last_score": stats.get("last_score"),
+        "question_correct_rate": [
+            question_correct.get(str(i), 0) / attempt_count if attempt_count else None
+            for i in range(stats.get("question_count", 0))
+        ],
+    }
 
 # API xử lý PDF
 @app.post("/upload")
-async def upload_pdf(file: UploadFile, current_user=Depends(get_current_user)):
-    # Tìm người dùng hiện tại
-    user = users_collection.find_one({"username": current_user["username"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
-    
-    upload_folder = "static"
-    
-    #if not os.path.exists(upload_folder):
-        #os.makedirs(upload_folder)
-    user_folder = os.path.join(upload_folder, user["username"])
-    
-    # Tạo thư mục gốc và thư mục con nếu chưa tồn tại
-    os.makedirs(user_folder, exist_ok=True)
-
-    file_location = os.path.join(user_folder, file.filename)
+async def upload_pdf(file: UploadFile, user=Depends(get_user_document)):
+    # Lưu file theo nội dung, file trùng chỉ lưu một lần
+    file_location, sha256 = await save_upload(file, user["username"])
 
-    with open(file_location, "wb") as buffer:
-        buffer.write(await file.read())
+    return {"filename": file.filename, "file_location": file_location, "sha256": sha256}
 
-    return {"filename": file.filename, "file_location": file_location}
+# Job xử lý PDF chạy nền
+@job_queue.handler("quiz")
+async def run_quiz_job(job):
+    user = await users_collection.find_one({"username": job.payload["username"]})
+    return await save_quiz(job.payload["file_location"], user, job, job.payload.get("fresh", False))
 
-def convert_to_ascii(input_string):
-    return unicodedata.normalize('NFKD', input_string).encode('ascii', 'ignore').decode('utf-8')
+@job_queue.handler("chat")
+async def run_chat_job(job):
+    user = await users_collection.find_one({"username": job.payload["username"]})
+    return await ingest_pdf_chat(job.payload["file_location"], job.payload["ascii_filename"], user, job)
 
 @app.post("/process-pdf-to-quiz")
-async def process_pdf_to_quiz(file: UploadFile, current_user=Depends(get_current_user)):
-    # Tìm người dùng hiện tại
-    user = users_collection.find_one({"username": current_user["username"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
-    
-    upload_folder = "static"
-    #if not os.path.exists(upload_folder):
-        #os.makedirs(upload_folder)
-    user_folder = os.path.join(upload_folder, user["username"])
-    
-    # Tạo thư mục gốc và thư mục con nếu chưa tồn tại
-    os.makedirs(user_folder, exist_ok=True)
+async def process_pdf_to_quiz(file: UploadFile, fresh: bool = False, user=Depends(get_user_document)):
+    # Lưu file PDF theo nội dung
+    file_location, _ = await save_upload(file, user["username"])
+    
+    # Tạo quiz chạy nền, trả về job id ngay; fresh=true bỏ qua câu hỏi đã cache và gọi lại Gemini
+    job_id = await job_queue.submit("quiz", {
+        "username": user["username"],
+        "file_location": file_location,
+        "fresh": fresh,
+    }, user["username"])
+    return {"job_id": job_id, "status": "queued"}
 
-    file_location = os.path.join(user_folder, file.filename)
+@app.post("/process-pdf-to-chat")
+async def process_pdf_to_chat(file: UploadFile, user=Depends(get_user_document)):
+    # Lưu file PDF theo nội dung
+    file_location, _ = await save_upload(file, user["username"])
+    
+    # Trích xuất, dịch và embedding chạy nền, trả về job id ngay
+    job_id = await job_queue.submit("chat", {
+        "username": user["username"],
+        "file_location": file_location,
+        "ascii_filename": convert_to_ascii(file.filename),
+    }, user["username"])
+    return {"job_id": job_id, "status": "queued"}
+
+# Tắt cache và buffer của proxy để sự kiện tới client ngay
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def format_job(job):
+    return {
+        "job_id": job["_id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "stages": job.get("stages", {}),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat(),
+    }
 
-    # Kiểm tra nếu tệp đã tồn tại, xóa nó đi trước khi lưu tệp mới
-    if os.path.exists(file_location):
-        os.remove(file_location)
-    
-    # Lưu file PDF
-    with open(file_location, "wb") as buffer:
-        buffer.write(await file.read())
-    
-    await save_quiz(file_location, user)
+async def get_user_job(job_id, current_user):
+    job = await job_queue.get(job_id)
+    if not job or job["username"] != current_user["username"]:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job
 
-@app.post("/process-pdf-to-chat")
-async def process_pdf_to_chat(file: UploadFile, current_user=Depends(get_current_user)):
-    # Tìm người dùng hiện tại
-    user = users_collection.find_one({"username": current_user["username"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
-    
-    upload_folder = "static"
-    user_folder = os.path.join(upload_folder, user["username"])
-    
-    # Tạo thư mục gốc và thư mục con nếu chưa tồn tại
-    os.makedirs(user_folder, exist_ok=True)
+# API xem tiến độ job
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user=Depends(get_current_user)):
+    return format_job(await get_user_job(job_id, current_user))
 
-    file_location = os.path.join(user_folder, file.filename)
+# API theo dõi tiến độ job qua Server-Sent Events
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str, current_user=Depends(get_current_user)):
+    await get_user_job(job_id, current_user)
 
-    # Lưu file PDF
-    with open(file_location, "wb") as buffer:
-        buffer.write(await file.read())
-    
-    # Tải và xử lý nội dung PDF
-    processed_documents = await process_and_translate_chat(file_location)
+    async def event_stream():
+        async for job in job_queue.events(job_id):
+            yield f"data: {json.dumps(format_job(job), ensure_ascii=False)}\n\n"
 
-    text = "\n".join([doc["page_content"] for doc in processed_documents])
-    
-    text = clean_text(text)
-
-    # Chia nội dung theo trang
-    chunks = []
-    current_chunk = ""
-    page_number = None
-
-    for doc in processed_documents:
-        if doc["page_number"] != page_number:
-            if current_chunk:
-                chunks.append({
-                    "text": current_chunk,
-                    "page_number": page_number
-                })
-            current_chunk = doc["page_content"]
-            page_number = doc["page_number"]
-        else:
-            current_chunk += "\n" + doc["page_content"]
-    if current_chunk:
-        chunks.append({
-            "text": current_chunk,
-            "page_number": page_number
-        })
-        
-    # Chuyển đổi filename sang ASCII
-    ascii_filename = convert_to_ascii(file.filename)
-    
-    for i, chunk in enumerate(chunks):
-        embedding = embedding_model.encode(chunk["text"]).tolist()
-        
-        # Tạo vector ID
-        vector_id = f"{user["username"]}_{ascii_filename}_{i}"
-        
-        # Lưu vector vào Pinecone
-        pinecone_index.upsert(
-            vectors=[(vector_id, embedding, {"metadata": f"Page {chunk["page_number"]} :" + chunk["text"], "page_number": chunk["page_number"]})],
-            namespace=f"{user["username"]}.{ascii_filename}",
-        )
-
-    # Lưu tên PDF vào users.collection
-    users_collection.update_one(
-        {"username": user["username"]},
-        {"$addToSet": {"pdfs_chat": ascii_filename}},
-        upsert=True
-    )
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @app.get("/user-pdfs-chat")
-async def get_user_pdfs_chat(current_user=Depends(get_current_user)):
-    # Tìm người dùng hiện tại
-    user = users_collection.find_one({"username": current_user["username"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
-    
+async def get_user_pdfs_chat(user=Depends(get_user_document)):
     pdfs = user["pdfs_chat"]  # Lấy danh sách PDF từ thông tin người dùng
     return {"pdfs": pdfs}   
 
-@app.post("/chat")
-async def chat_with_pdf(request: ChatRequest, current_user=Depends(get_current_user)):
-    # Tìm người dùng hiện tại
-    user = users_collection.find_one({"username": current_user["username"]})
-    if not user:
-        raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
-    try:
-        query = request.query
-        query_embedding = embedding_model.encode(query).tolist()
-
-        search_results = []
-        if(request.pdf) :
-            search_results = pinecone_index.query(
-                namespace=f"{user["username"]}.{request.pdf}",
-                vector=query_embedding, 
-                top_k=5, 
-                include_metadata=True
-                )
-        # Nếu người dùng không chọn PDF hoặc không có PDF thì tìm trong namespace mặc định
-        else :
-            search_results = pinecone_index.query(
-                namespace=f"",
-                vector=query_embedding, 
-                top_k=5, 
-                include_metadata=True
-                )
-        
-        # context = "\n".join(match.metadata["metadata"] for match in search_results["matches"])
-        # Thay thế phần xử lý context
-        context = "\n".join(
-            str(match.metadata.get("metadata", "")) 
-            for match in search_results.get("matches", [])
-        )
-        
-        # Tạo một dictionary chỉ với các thông tin cần thiết
-        formatted_results = [
-            {
-                "id": match.get("id", ""),
-                "score": match.get("score", 0),
-                "metadata": match.metadata.get("metadata", ""),  # Chỉ lấy metadata cần thiết
-            }
-            for match in search_results.get("matches", [])
-        ]
-        
-        prompt = (
-                    f"Context:\n{context}\n\n"
-                    f"User Query:\n{query}\n\n"
-                    f"Instructions:\n"
-                    f"1. Provide a clear and concise response to the user's query based on the provided context.\n"
-                    f"2. Ensure the response is formatted for display in a report, not includes any specific character like (**) and adhering to react-markdown syntax.\n"
-                    f"3. If additional information is required or the query cannot be answered fully, provide a helpful and polite clarification to the user \n\n"
-                    f"Example format:\n"
-                    f"Respond by saying that the answer to the question has been found, and smoothly lead into the answer\n"
-                    f"1. Any subtitle\n"
-                    f"2. Next subtitle\n"
-                    f"3. ....\n"
-                    f"Consume and condition!\n"
-                    f"Additionally, offer related follow-up questions to guide the user further. \n\n"
-                    f"Response:\n"
-        )
-        question_prompt = PromptTemplate(
-                        template=prompt,
-                        input_variables=["context", "query"]
-        )
-        formatted_prompt = question_prompt.format(context=context, query=query)
-        response = (
-                    model.generate_content(formatted_prompt).candidates[0].content.parts[0].text
-                    if formatted_results != []
-                    else "I am a chatbot designed to answer questions about the PDF you have provided. \
+NO_CONTEXT_RESPONSE = "I am a chatbot designed to answer questions about the PDF you have provided. \
                         Your question does not fall within the system's setup or may not be related to \
                         the content of the PDF you uploaded. Please ask another question, \
                         and I will assist you."
-        )
+
+# Số đoạn lấy ra cho mỗi câu hỏi: chunk theo token nhỏ và sát nội dung nên cần ít đoạn hơn
+chat_top_k = int(os.getenv("CHAT_TOP_K", 4))
+
+# Giới hạn token của context đưa vào prompt chat
+context_builder = ContextBuilder(int(os.getenv("CHAT_CONTEXT_TOKENS", 1500)))
+
+# Tìm các đoạn liên quan tới câu hỏi trong PDF của người dùng (vector + BM25)
+def search_pdf(user, request):
+    query = request.query
+    query_embedding = embed_query(query)
+
+    # Nếu người dùng không chọn PDF hoặc không có PDF thì tìm trong namespace mặc định
+    namespace = f"{user["username"]}.{request.pdf}" if request.pdf else ""
+    with metrics.span("retrieve"):
+        matches = retriever.search(query, query_embedding, chat_top_k, namespace)
+    
+    # Ghép context trong giới hạn token, chỉ giữ các câu liên quan tới câu hỏi
+    with metrics.span("build_context"):
+        context = context_builder.build(query, matches)
+    
+    # Tạo một dictionary chỉ với các thông tin cần thiết
+    formatted_results = [
+        {
+            "id": match["id"],
+            "score": match["score"],
+            "vector_score": match["vector_score"],
+            "keyword_score": match["keyword_score"],
+            "metadata": match["metadata"].get("metadata", ""),  # Chỉ lấy metadata cần thiết
+        }
+        for match in matches
+    ]
+    return namespace, context, formatted_results
+
+# Template tĩnh, chỉ tạo một lần
+chat_prompt = PromptTemplate(template=ChatPrompt, input_variables=["context", "query"])
+
+def build_chat_prompt(context, query):
+    formatted_prompt = chat_prompt.format(context=context, query=query)
+    metrics.inc("gemini_requests", kind="chat")
+    metrics.inc("gemini_prompt_tokens", estimate_tokens(formatted_prompt), kind="chat")
+    return formatted_prompt
+
+@app.post("/chat")
+async def chat_with_pdf(request: ChatRequest, user=Depends(get_user_document)):
+    try:
+        # Embedding câu hỏi và truy vấn vector chạy trên thread pool
+        namespace, context, formatted_results = await compute.run_blocking(search_pdf, user, request)
+        
+        if formatted_results == []:
+            response = NO_CONTEXT_RESPONSE
+        else:
+            # Dùng lại câu trả lời nếu cùng câu hỏi và cùng các đoạn tìm được
+            cache_key = await answer_cache_key(namespace, request.query, [result["id"] for result in formatted_results])
+            response = answer_cache.get(cache_key)
+            if response is None:
+                formatted_prompt = build_chat_prompt(context, request.query)
+                with metrics.span("gemini", kind="chat"):
+                    response = (await get_model().generate_content_async(formatted_prompt)).candidates[0].content.parts[0].text
+                answer_cache.set(cache_key, response)
         return { 
             "response": response,
             "search_results": formatted_results if formatted_results != [] else "Không có dữ liệu từ search"
         }
     except Exception as e:
-        return { "error": str(e) }
\ No newline at end of file
+        return { "error": str(e) }
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# API chat trả lời dạng stream (Server-Sent Events): kết quả tìm kiếm trước, sau đó từng token của Gemini
+@app.post("/chat/stream")
+async def chat_with_pdf_stream(request: ChatRequest, user=Depends(get_user_document)):
+    async def event_stream():
+        try:
+            namespace, context, formatted_results = await compute.run_blocking(search_pdf, user, request)
+            yield sse_event("search_results", formatted_results if formatted_results != [] else "Không có dữ liệu từ search")
+
+            if formatted_results == []:
+                yield sse_event("token", NO_CONTEXT_RESPONSE)
+            else:
+                cache_key = await answer_cache_key(namespace, request.query, [result["id"] for result in formatted_results])
+                cached = answer_cache.get(cache_key)
+                if cached is not None:
+                    yield sse_event("token", cached)
+                else:
+                    formatted_prompt = build_chat_prompt(context, request.query)
+                    tokens = []
+                    # Span gồm cả thời gian gửi từng token tới client
+                    with metrics.span("gemini", kind="chat_stream"):
+                        response = await get_model().generate_content_async(formatted_prompt, stream=True)
+                        async for chunk in response:
+                            if chunk.candidates and chunk.candidates[0].content.parts:
+                                tokens.append(chunk.candidates[0].content.parts[0].text)
+                                yield sse_event("token", tokens[-1])
+                    answer_cache.set(cache_key, "".join(tokens))
+            yield sse_event("done", {})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def collect_stats():
+    return {
+        "startup": resources.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "question_cache": question_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "compute": compute.stats(),
+        "password_hashing": password_hashing_stats(),
+    }
+
+# API thống kê cache, hàng đợi tính toán và thời gian khởi động
+@app.get("/api/stats")
+async def get_stats():
+    return collect_stats()
+
+# Metrics dạng Prometheus: counter và histogram của từng stage, cùng các thống kê ở /api/stats dưới dạng gauge
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(collect_stats()), media_type="text/plain; version=0.0.4")
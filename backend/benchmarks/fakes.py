@@ -0,0 +1,392 @@
+"""
+Deterministic local stand-ins for the external services, used by the benchmarks.
+
+Each fake is installed through the factory of the matching lazy resource (see
+src/Resources.py), so the application code under test runs unchanged.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from types import SimpleNamespace
+import numpy as np
+from bson import ObjectId
+from src.VectorStore import VectorStore
+
+
+def stable_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def text_response(text):
+    # Cấu trúc tối thiểu của GenerateContentResponse mà ứng dụng đọc
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))])
+
+
+class FakeGenerativeModel:
+    """
+    Answers like Gemini: a JSON question array for quiz prompts, a short report otherwise.
+
+    Args:
+        latency (float): Seconds slept per call to simulate the provider round trip.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def respond(self, prompt):
+        self.calls += 1
+        seed = stable_hash(prompt)
+
+        if "QUESTIONS:" in prompt:
+            questions = [
+                {"question": f"Statement {seed % 997} is correct.", "options": ["True", "False"], "answer": bool(seed & 1)},
+                {
+                    "question": f"Which option matches item {seed % 991}?",
+                    "options": ["A", "B", "C", "D"],
+                    "answer": seed % 4,
+                },
+            ]
+            return "```json\n" + json.dumps(questions, indent=2) + "\n```\n"
+
+        return f"The answer has been found.\n1. Summary\nResult {seed % 1000} from the provided context.\n"
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        return text_response(self.respond(prompt))
+
+    async def generate_content_async(self, prompt, stream=False):
+        await asyncio.sleep(self.latency)
+        text = self.respond(prompt)
+        if not stream:
+            return text_response(text)
+
+        async def chunks():
+            for part in re.findall(r"\S+\s*", text):
+                yield text_response(part)
+
+        return chunks()
+
+
+class FakeTranslator:
+    """
+    Async googletrans stand-in: "translates" by stripping diacritics, keeping the length
+    and the batch separators of the input.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def translate(self, text, src="auto", dest="en"):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        ascii_text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+        return SimpleNamespace(text=ascii_text, src=src, dest=dest)
+
+
+class FakeTokenizer:
+    """
+    Word-piece-like tokenizer returning offset mappings, as the HuggingFace fast tokenizers do.
+    """
+
+    pattern = re.compile(r"\w+|[^\w\s]")
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False, verbose=True):
+        return {"offset_mapping": [(match.start(), match.end()) for match in self.pattern.finditer(text)]}
+
+
+class FakeEmbeddingModel:
+    """
+    SentenceTransformer stand-in: hashed bag-of-words vectors, so similar texts still get
+    similar embeddings.
+    """
+
+    def __init__(self, dimension=384, max_seq_length=256):
+        self.dimension = dimension
+        self.max_seq_length = max_seq_length
+        self.tokenizer = FakeTokenizer()
+
+    def embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[stable_hash(word) % self.dimension] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        if isinstance(texts, str):
+            return self.embed(texts)
+        return np.stack([self.embed(text) for text in texts]) if texts else np.zeros((0, self.dimension))
+
+
+class InMemoryVectorStore(VectorStore):
+    """
+    Exact cosine search over vectors kept in a dict per namespace.
+    """
+
+    def __init__(self):
+        self.namespaces = {}
+
+    def upsert(self, vectors, namespace):
+        store = self.namespaces.setdefault(namespace, {})
+        for vector_id, values, metadata in vectors:
+            values = np.asarray(values, dtype=np.float32)
+            norm = np.linalg.norm(values)
+            store[vector_id] = (values / norm if norm else values, metadata)
+
+    def query(self, vector, top_k, namespace, include_metadata=True):
+        store = self.namespaces.get(namespace, {})
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        scored = sorted(
+            ((float(values @ query), vector_id, metadata) for vector_id, (values, metadata) in store.items()),
+            reverse=True,
+        )[:top_k]
+        return {
+            "matches": [
+                {"id": vector_id, "score": score, "metadata": metadata if include_metadata else {}}
+                for score, vector_id, metadata in scored
+            ]
+        }
+
+    def delete(self, ids, namespace):
+        store = self.namespaces.get(namespace, {})
+        for vector_id in ids:
+            store.pop(vector_id, None)
+
+    def delete_namespace(self, namespace):
+        self.namespaces.pop(namespace, None)
+
+
+# MongoDB giả lập: chỉ hỗ trợ các toán tử ứng dụng đang dùng
+
+MISSING = object()
+
+
+def get_path(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+    return value
+
+
+def set_path(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def compare(op, value, arg):
+    if value is MISSING or value is None:
+        return False
+    return {
+        "$gt": lambda: value > arg,
+        "$gte": lambda: value >= arg,
+        "$lt": lambda: value < arg,
+        "$lte": lambda: value <= arg,
+    }[op]()
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub_query) for sub_query in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, sub_query) for sub_query in condition):
+                return False
+            continue
+
+        value = get_path(doc, key)
+        if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+            for op, arg in condition.items():
+                if op == "$in":
+                    ok = value in arg if value is not MISSING else None in arg
+                elif op == "$nin":
+                    ok = value not in arg
+                elif op == "$ne":
+                    ok = value != arg
+                elif op == "$exists":
+                    ok = (value is not MISSING) == bool(arg)
+                else:
+                    ok = compare(op, value, arg)
+                if not ok:
+                    return False
+        elif (None if value is MISSING else value) != condition:
+            return False
+    return True
+
+
+def evaluate(expression, doc):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = get_path(doc, expression[1:])
+        return None if value is MISSING else value
+    if isinstance(expression, dict) and len(expression) == 1:
+        (op, arg), = expression.items()
+        if op == "$size":
+            return len(evaluate(arg, doc))
+        if op == "$ifNull":
+            value = evaluate(arg[0], doc)
+            return value if value is not None else evaluate(arg[1], doc)
+    return expression
+
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+
+    include = {k: v for k, v in projection.items() if v not in (0, False)}
+    if not include:
+        result = copy.deepcopy(doc)
+        for key in projection:
+            result.pop(key, None)
+        return result
+
+    result = {"_id": doc["_id"]} if projection.get("_id", 1) and "_id" in doc else {}
+    for key, spec in include.items():
+        if isinstance(spec, dict):
+            result[key] = evaluate(spec, doc)
+        else:
+            # Trường lồng nhau ("questions.answer") trả về cả trường cấp trên
+            top = key.split(".")[0]
+            if top in doc:
+                result[top] = copy.deepcopy(doc[top])
+    return result
+
+
+def apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            current = get_path(doc, path)
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                set_path(doc, path, copy.deepcopy(arg))
+            elif op == "$inc":
+                set_path(doc, path, (0 if current is MISSING else current) + arg)
+            elif op == "$push":
+                set_path(doc, path, ([] if current is MISSING else current) + [arg])
+            elif op == "$addToSet":
+                items = [] if current is MISSING else current
+                set_path(doc, path, items if arg in items else items + [arg])
+            elif op == "$pull" and current is not MISSING:
+                set_path(doc, path, [item for item in current if item != arg])
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+        self._limit = None
+
+    def sort(self, key, direction=1):
+        # sort("field", -1) hoặc sort([("field", -1), ...]) như Motor
+        keys = key if isinstance(key, list) else [(key, direction)]
+        # Sắp xếp ổn định từ khóa cuối lên khóa đầu
+        for path, path_direction in reversed(keys):
+            self.docs = sorted(self.docs, key=lambda doc: get_path(doc, path), reverse=path_direction < 0)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _results(self):
+        return self.docs[:self._limit] if self._limit else self.docs
+
+    async def to_list(self, length=None):
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        async def iterate():
+            for doc in self._results():
+                yield doc
+        return iterate()
+
+
+class FakeCollection:
+    """
+    In-memory async collection implementing the subset of the Motor API used by the app.
+    """
+
+    def __init__(self):
+        self.docs = []
+
+    async def create_index(self, keys, **kwargs):
+        return None
+
+    async def find_one(self, query=None, projection=None):
+        for doc in self.docs:
+            if matches(doc, query or {}):
+                return project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([project(doc, projection) for doc in self.docs if matches(doc, query or {})])
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=False):
+        # return_document: False trả về bản trước khi sửa, True (ReturnDocument.AFTER) bản sau
+        for doc in self.docs:
+            if matches(doc, query):
+                before = project(doc, projection)
+                apply_update(doc, update)
+                return project(doc, projection) if return_document else before
+        return None
+
+    async def insert_one(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        self.docs.append(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                apply_update(doc, update)
+                return SimpleNamespace(matched_count=1, upserted_id=None)
+
+        if not upsert:
+            return SimpleNamespace(matched_count=0, upserted_id=None)
+
+        doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+        apply_update(doc, update, inserting=True)
+        result = await self.insert_one(doc)
+        return SimpleNamespace(matched_count=0, upserted_id=result.inserted_id)
+
+    async def delete_one(self, query):
+        for i, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[i]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query):
+        before = len(self.docs)
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+
+class FakeMongoClient:
+    def __init__(self):
+        self.database = FakeDatabase()
+
+    def get_default_database(self):
+        return self.database
@@ -0,0 +1,246 @@
+"""
+Offline benchmarks of the ingestion and chat pipelines.
+
+Every external service is replaced by a deterministic stand-in (benchmarks/fakes.py) and the
+input PDFs are generated (benchmarks/synthetic_pdf.py), so the suite runs anywhere without
+credentials or network access:
+
+    cd backend
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --baseline bench.json --max-regression 0.25
+
+The process exits with status 1 when a p95 latency regresses past the allowed ratio.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def summarize(samples, wall_time):
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": percentile(samples, 0.50),
+        "p95": percentile(samples, 0.95),
+        "throughput": len(samples) / wall_time if wall_time else 0.0,
+    }
+
+
+async def measure(fn, inputs, concurrency=1):
+    """
+    Awaits fn(item) for every input with at most `concurrency` calls in flight.
+
+    Returns:
+        dict: count, mean/p50/p95 latency in seconds and throughput in calls per second.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def timed(item):
+        async with semaphore:
+            started = time.perf_counter()
+            result = fn(item)
+            if asyncio.iscoroutine(result):
+                await result
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(item) for item in inputs))
+    return summarize(samples, time.perf_counter() - started)
+
+
+def prepare_environment(work_dir):
+    """
+    Runs the app from an empty working directory so every on-disk cache starts cold, and
+    lifts the Gemini rate limit that would otherwise dominate the timings.
+    """
+    os.makedirs(os.path.join(work_dir, "static"), exist_ok=True)
+    os.chdir(work_dir)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+    os.environ.setdefault("JWT_ALGORITHM", "HS256")
+    os.environ.setdefault("JWT_EXPIRATION", "60")
+    os.environ.setdefault("GEMINI_RPM", "1000000000")
+    os.environ.setdefault("GEMINI_TPM", "1000000000000")
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+
+def install_fakes(args):
+    """
+    Points the lazy resources of the app at the local stand-ins before anything uses them.
+    """
+    import utils
+    import src.PdfExtractor as PdfExtractor
+    import src.QAGenerator as QAGenerator
+    from benchmarks.fakes import (
+        FakeEmbeddingModel, FakeGenerativeModel, FakeMongoClient, FakeTranslator, InMemoryVectorStore,
+    )
+
+    QAGenerator.gemini_model.factory = lambda: FakeGenerativeModel(args.llm_latency)
+    utils.translator.factory = lambda: FakeTranslator(args.translate_latency)
+    utils.embedding_model.factory = FakeEmbeddingModel
+    utils.vector_index.factory = InMemoryVectorStore
+    utils.mongo_client.factory = FakeMongoClient
+
+    # Không có Tesseract: trả về văn bản cố định cho mỗi ảnh thay vì OCR thật
+    if not args.ocr:
+        PdfExtractor.extract_text_from_image = lambda images: {
+            image_hash: f"Figure {image_hash[:8]} shows the experiment setup." for image_hash in images
+        }
+
+
+async def run_benchmarks(args, work_dir):
+    import httpx
+    import utils
+    from app import app
+    from benchmarks.synthetic_pdf import VOCABULARY, make_pdf
+    from src.Compute import compute
+
+    rng = random.Random(args.seed)
+    words = VOCABULARY[args.language]
+    results = {}
+
+    # Mỗi lần đo dùng một PDF khác nhau để cache dịch/xử lý không bị trúng
+    pdfs = [
+        make_pdf(os.path.join(work_dir, f"doc_{i}.pdf"), pages=args.pages, seed=args.seed + i, language=args.language)
+        for i in range(args.iterations + 1)
+    ]
+    warmup_pdf, pdfs = pdfs[0], pdfs[1:]
+
+    await utils.users_collection.insert_one({"username": "bench", "password": "", "quizzes": [], "pdfs_chat": []})
+    user = await utils.users_collection.find_one({"username": "bench"})
+    headers = {"Authorization": f"Bearer {utils.create_jwt({'username': 'bench'})}"}
+
+    # Lần chạy làm nóng: nạp các model giả, pool và import trễ
+    utils.file_processing_chat(warmup_pdf)
+    await utils.llm_pipeline_quiz(warmup_pdf)
+
+    results["file_processing_chat"] = await measure(utils.file_processing_chat, pdfs)
+    results["file_processing_quiz"] = await measure(utils.file_processing_quiz, pdfs)
+    results["llm_pipeline_quiz"] = await measure(utils.llm_pipeline_quiz, pdfs)
+    results["ingest_pdf_chat"] = await measure(
+        lambda path: utils.ingest_pdf_chat(path, os.path.basename(path), user), pdfs
+    )
+
+    # Quiz của người dùng cho /api/quizzes
+    for i in range(args.quizzes):
+        inserted = await utils.quizzes_collection.insert_one({
+            "quiz_name": f"quiz_{i}",
+            "questions": [{"question": f"Q{j}", "options": ["True", "False"], "answer": "True"} for j in range(20)],
+        })
+        await utils.users_collection.update_one({"username": "bench"}, {"$push": {"quizzes": str(inserted.inserted_id)}})
+    utils.invalidate_user("bench")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        async def chat(query):
+            response = await client.post("/chat", json={"query": query, "pdf": os.path.basename(pdfs[0])}, headers=headers)
+            response.raise_for_status()
+            # /chat trả lỗi trong body với mã 200
+            if "error" in response.json():
+                raise RuntimeError(response.json()["error"])
+
+        async def list_quizzes(summary):
+            response = await client.get("/api/quizzes", params={"summary": summary}, headers=headers)
+            response.raise_for_status()
+
+        # Câu hỏi khác nhau để không trúng cache câu trả lời
+        queries = [" ".join(rng.choice(words) for _ in range(6)) + "?" for _ in range(args.requests)]
+        await chat("warm up")
+        results["/chat"] = await measure(chat, queries, args.concurrency)
+        results["/api/quizzes"] = await measure(list_quizzes, [False] * args.requests, args.concurrency)
+        results["/api/quizzes?summary"] = await measure(list_quizzes, [True] * args.requests, args.concurrency)
+
+    compute.shutdown()
+    return results
+
+
+def print_report(results, baseline=None):
+    print(f"{'benchmark':<24}{'n':>5}{'mean ms':>11}{'p50 ms':>10}{'p95 ms':>10}{'ops/s':>10}{'p95 vs base':>13}")
+    for name, stats in results.items():
+        change = ""
+        if baseline and name in baseline and baseline[name]["p95"]:
+            change = f"{stats['p95'] / baseline[name]['p95'] - 1:+.1%}"
+        print(
+            f"{name:<24}{stats['count']:>5}{stats['mean'] * 1000:>11.2f}{stats['p50'] * 1000:>10.2f}"
+            f"{stats['p95'] * 1000:>10.2f}{stats['throughput']:>10.2f}{change:>13}"
+        )
+
+
+def find_regressions(results, baseline, max_regression):
+    return [
+        name for name, stats in results.items()
+        if name in baseline and stats["p95"] > baseline[name]["p95"] * (1 + max_regression)
+    ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the PDF and chat pipelines")
+    parser.add_argument("--iterations", type=int, default=5, help="PDFs processed per pipeline benchmark")
+    parser.add_argument("--pages", type=int, default=8, help="pages per synthetic PDF")
+    parser.add_argument("--language", choices=["vi", "en"], default="vi", help="language of the synthetic PDFs")
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint benchmark")
+    parser.add_argument("--concurrency", type=int, default=4, help="endpoint requests in flight")
+    parser.add_argument("--quizzes", type=int, default=100, help="quizzes owned by the benchmark user")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated Gemini latency in seconds")
+    parser.add_argument("--translate-latency", type=float, default=0.0, help="simulated translation latency in seconds")
+    parser.add_argument("--ocr", action="store_true", help="run real Tesseract OCR on the images")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed p95 increase over the baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="quiz-bench-") as work_dir:
+        cwd = os.getcwd()
+        prepare_environment(work_dir)
+        try:
+            install_fakes(args)
+            results = asyncio.run(run_benchmarks(args, work_dir))
+        finally:
+            os.chdir(cwd)
+
+    print_report(results, baseline)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        regressions = find_regressions(results, baseline, args.max_regression)
+        if regressions:
+            print(f"p95 regression over {args.max_regression:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Generator of synthetic course PDFs with text, images and ruled tables.
+
+Documents are fully determined by their seed, so benchmark runs compare like with like.
+"""
+import random
+
+VOCABULARY = {
+    "vi": (
+        "học sinh giáo viên bài giảng kiến thức phương pháp nghiên cứu điện từ trường năng lượng "
+        "hệ thống dữ liệu thuật toán mô hình phân tích kết quả thí nghiệm công thức định luật "
+        "chương trình máy tính mạng lưới ứng dụng thực tế quá trình phát triển môi trường "
+        "khái niệm cơ bản nâng cao ví dụ minh họa câu hỏi trả lời tổng kết đánh giá"
+    ).split(),
+    "en": (
+        "student teacher lecture knowledge method research electromagnetic field energy system "
+        "data algorithm model analysis result experiment formula law program computer network "
+        "application practice process development environment concept basic advanced example "
+        "illustration question answer summary evaluation"
+    ).split(),
+}
+
+
+def make_sentence(rng, words):
+    sentence = " ".join(rng.choice(words) for _ in range(rng.randint(8, 20)))
+    return sentence[0].upper() + sentence[1:] + "."
+
+
+def make_paragraph(rng, words, sentences=5):
+    return " ".join(make_sentence(rng, words) for _ in range(sentences))
+
+
+def make_table_html(rng, words, rows=4, columns=3):
+    cell = 'style="border: 1px solid black; padding: 3px"'
+    body = "".join(
+        "<tr>" + "".join(f"<td {cell}>{rng.choice(words)} {rng.randint(0, 999)}</td>" for _ in range(columns)) + "</tr>"
+        for _ in range(rows)
+    )
+    return f'<table style="border-collapse: collapse">{body}</table>'
+
+
+def make_image(rng, width=160, height=100):
+    import fitz
+
+    pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, width, height), False)
+    pixmap.set_rect(pixmap.irect, (255, 255, 255))
+    # Vài khối màu ngẫu nhiên để mỗi ảnh có nội dung (và hash) khác nhau
+    for _ in range(6):
+        x, y = rng.randrange(width - 20), rng.randrange(height - 20)
+        pixmap.set_rect(fitz.IRect(x, y, x + 20, y + 20), tuple(rng.randrange(256) for _ in range(3)))
+    return pixmap
+
+
+def make_pdf(path, pages=10, seed=0, language="vi", images_per_page=1, tables_per_page=1):
+    """
+    Writes a synthetic PDF.
+
+    Every page gets three paragraphs, `images_per_page` distinct images plus a logo shared
+    by all pages (to exercise image de-duplication), and `tables_per_page` ruled tables.
+
+    Args:
+        path (str): Output file.
+        pages (int): Number of pages.
+        seed (int): Seed of the content.
+        language (str): "vi" or "en" vocabulary.
+        images_per_page (int): Distinct images per page.
+        tables_per_page (int): Tables per page.
+
+    Returns:
+        str: path
+    """
+    import fitz
+
+    rng = random.Random(seed)
+    words = VOCABULARY[language]
+    logo = make_image(random.Random(-1), 64, 64)
+
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        html = "".join(f"<p>{make_paragraph(rng, words)}</p>" for _ in range(3))
+        page.insert_htmlbox(fitz.Rect(50, 90, 545, 470), html)
+
+        page.insert_image(fitz.Rect(480, 20, 544, 84), pixmap=logo)
+        for i in range(images_per_page):
+            left = 50 + i * 170
+            page.insert_image(fitz.Rect(left, 480, left + 160, 580), pixmap=make_image(rng))
+
+        for i in range(tables_per_page):
+            top = 600 + i * 110
+            page.insert_htmlbox(fitz.Rect(50, top, 400, top + 100), make_table_html(rng, words))
+
+    doc.save(path)
+    doc.close()
+    return path
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_hash(data):
+    """
+    Returns the sha256 hex digest of bytes or text.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class DiskCache:
+    """
+    Persistent key -> JSON value cache, stored as one file per key.
+
+    Args:
+        directory (str): Folder holding the cache files.
+        max_entries (int): Optional bound; the least recently used files are removed past it.
+    """
+
+    def __init__(self, directory, max_entries=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return default
+
+        # Cập nhật thời gian truy cập để loại bỏ theo LRU
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Ghi ra file tạm rồi đổi tên để không đọc phải file ghi dở
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        # Chỉ quét thư mục định kỳ thay vì sau mỗi lần ghi
+        self._writes += 1
+        if self.max_entries and self._writes >= max(1, self.max_entries // 10):
+            self._writes = 0
+            self.evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    yield os.path.join(root, name)
+
+    def evict(self):
+        with self._lock:
+            entries = list(self._entries())
+            if len(entries) <= self.max_entries:
+                return
+
+            entries.sort(key=lambda path: os.path.getmtime(path))
+            for path in entries[:len(entries) - self.max_entries]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with optional time-to-live.
+
+    Args:
+        maxsize (int): Maximum number of entries kept.
+        ttl (float): Seconds an entry stays valid, None for no expiry.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or (item[0] is not None and item[0] < time.monotonic()):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_where(self, predicate):
+        """
+        Removes every entry whose key matches the predicate.
+        """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,47 @@
+class TokenChunker:
+    """
+    Splits text into windows measured in tokens of the embedding model's own tokenizer.
+
+    Every window fits in the model input, so no token is silently truncated at encode
+    time, and consecutive windows share `overlap` tokens so a sentence cut by a window
+    boundary is still whole in one of them.
+
+    Args:
+        tokenizer: HuggingFace fast tokenizer (needs offset mapping support).
+        max_tokens (int): Tokens per window, without the special tokens added by the model.
+        overlap (int): Tokens shared by consecutive windows.
+    """
+
+    def __init__(self, tokenizer, max_tokens, overlap=32):
+        if not 0 <= overlap < max_tokens:
+            raise ValueError("overlap must be smaller than max_tokens")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+
+    def split(self, text):
+        """
+        Args:
+            text (str): Text to split.
+
+        Returns:
+            list: {"text", "start", "end"} windows, start/end being character offsets in text.
+        """
+        offsets = self.tokenizer(
+            text,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            verbose=False,
+        )["offset_mapping"]
+
+        windows = []
+        step = self.max_tokens - self.overlap
+
+        for first in range(0, len(offsets), step):
+            last = min(first + self.max_tokens, len(offsets)) - 1
+            start, end = offsets[first][0], offsets[last][1]
+            windows.append({"text": text[start:end], "start": start, "end": end})
+            if last == len(offsets) - 1:
+                break
+
+        return windows
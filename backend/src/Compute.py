@@ -0,0 +1,177 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def _timed_call(fn, args, kwargs):
+    """
+    Runs fn inside the worker and reports when it actually started.
+    """
+    started_at = time.time()
+    return started_at, fn(*args, **kwargs)
+
+
+class PoolStats:
+    """
+    Counters of one executor: queue depth, wait time (submit -> start) and run time.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self._lock = threading.Lock()
+
+    def on_submit(self):
+        with self._lock:
+            self.submitted += 1
+
+    def on_done(self, submitted_at, started_at, finished_at, failed=False):
+        wait = max(0.0, started_at - submitted_at)
+        with self._lock:
+            self.completed += 1
+            self.failed += failed
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.total_run += max(0.0, finished_at - started_at)
+
+    def snapshot(self):
+        with self._lock:
+            in_flight = self.submitted - self.completed
+            return {
+                "max_workers": self.max_workers,
+                "in_flight": in_flight,
+                # Executor chạy theo FIFO: phần vượt quá số worker đang chờ trong hàng đợi
+                "queue_depth": max(0, in_flight - self.max_workers),
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_seconds": self.total_wait / self.completed if self.completed else 0.0,
+                "max_wait_seconds": self.max_wait,
+                "avg_run_seconds": self.total_run / self.completed if self.completed else 0.0,
+            }
+
+
+class ComputePool:
+    """
+    Managed executors for work that must not run on the event loop.
+
+    A thread pool takes blocking I/O and libraries that release the GIL (model inference,
+    network clients, PDF parsing); a process pool takes pure-Python CPU work such as OCR.
+    Both are created on first use.
+
+    Args:
+        thread_workers (int): Size of the thread pool.
+        process_workers (int): Size of the process pool.
+        start_method (str): multiprocessing start method of the process pool; defaults to
+            "forkserver" ("spawn" where it is not available).
+    """
+
+    def __init__(self, thread_workers, process_workers, start_method=None):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        # Process pool được tạo muộn, khi tiến trình đã có nhiều thread: fork lúc đó có thể
+        # sao chép lock đang bị giữ, nên tạo worker từ forkserver hoặc spawn
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.start_method = start_method
+        self._threads = None
+        self._processes = None
+        self._thread_stats = PoolStats(thread_workers)
+        self._process_stats = PoolStats(process_workers)
+        self._lock = threading.Lock()
+
+    def _thread_pool(self):
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="compute")
+            return self._threads
+
+    def _process_pool(self):
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                )
+            return self._processes
+
+    def _submit(self, pool, stats, fn, args, kwargs):
+        submitted_at = time.time()
+        stats.on_submit()
+        future = pool.submit(_timed_call, fn, args, kwargs)
+
+        def done(future):
+            finished_at = time.time()
+            if future.exception() is None:
+                started_at = future.result()[0]
+                stats.on_done(submitted_at, started_at, finished_at)
+            else:
+                stats.on_done(submitted_at, finished_at, finished_at, failed=True)
+
+        future.add_done_callback(done)
+        return future
+
+    def submit_blocking(self, fn, *args, **kwargs):
+        """
+        Schedules fn on the thread pool; returns a future resolving to (started_at, result).
+        """
+        # Chạy trong bản sao context hiện tại (như asyncio.to_thread) để span ghi vào trace của request
+        context = contextvars.copy_context()
+        return self._submit(self._thread_pool(), self._thread_stats, context.run, (fn, *args), kwargs)
+
+    def submit_cpu(self, fn, *args, **kwargs):
+        """
+        Schedules fn on the process pool; returns a future resolving to (started_at, result).
+        fn and its arguments must be picklable.
+        """
+        return self._submit(self._process_pool(), self._process_stats, fn, args, kwargs)
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """
+        Awaits fn(*args, **kwargs) executed on the thread pool.
+        """
+        _, result = await asyncio.wrap_future(self.submit_blocking(fn, *args, **kwargs))
+        return result
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        """
+        Awaits fn(*args, **kwargs) executed on the process pool.
+        """
+        _, result = await asyncio.wrap_future(self.submit_cpu(fn, *args, **kwargs))
+        return result
+
+    def map_cpu(self, fn, items):
+        """
+        Runs fn over items on the process pool from synchronous code, keeping the order.
+        """
+        futures = [self.submit_cpu(fn, item) for item in items]
+        return [future.result()[1] for future in futures]
+
+    def shutdown(self):
+        with self._lock:
+            for pool in (self._threads, self._processes):
+                if pool is not None:
+                    pool.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+            self._processes = None
+
+    def stats(self):
+        return {
+            "threads": self._thread_stats.snapshot(),
+            "processes": self._process_stats.snapshot(),
+        }
+
+
+compute = ComputePool(
+    thread_workers=int(os.getenv("COMPUTE_THREAD_WORKERS", min(32, (os.cpu_count() or 1) + 4))),
+    process_workers=int(os.getenv("COMPUTE_PROCESS_WORKERS", os.cpu_count() or 1)),
+    start_method=os.getenv("COMPUTE_START_METHOD"),
+)
@@ -0,0 +1,81 @@
+import re
+from src.QAGenerator import estimate_tokens
+from src.Retrieval import PAGE_PREFIX, tokenize
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+class ContextBuilder:
+    """
+    Assembles the chat context from retrieved passages within a fixed token budget.
+
+    Passages are taken best score first. Each one is cut down to the sentences sharing a
+    term with the query, then to what is left of the budget, so the prompt size stays
+    bounded however long the source pages are. A passage with no such sentence (a purely
+    semantic hit) keeps its leading sentences, limited to an even share of the budget left.
+
+    Args:
+        max_tokens (int): Token budget of the whole context.
+        count_tokens (callable): Token estimate of a string.
+    """
+
+    def __init__(self, max_tokens, count_tokens=estimate_tokens):
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+
+    def select_sentences(self, query_terms, text):
+        """
+        Returns (sentences, matched): the sentences sharing a term with the query, or all
+        sentences and False when none does.
+        """
+        sentences = [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+        matching = [sentence for sentence in sentences if query_terms & set(tokenize(sentence))]
+        return (matching, True) if matching else (sentences, False)
+
+    def fit(self, sentences, budget):
+        """
+        Keeps whole sentences while they fit in budget; the first sentence is truncated
+        when even it does not fit.
+        """
+        kept, used = [], 0
+        for sentence in sentences:
+            tokens = self.count_tokens(sentence)
+            if used + tokens > budget:
+                if not kept:
+                    # Ước lượng 4 ký tự mỗi token như estimate_tokens
+                    kept.append(sentence[:max(0, budget * 4)])
+                break
+            kept.append(sentence)
+            used += tokens
+        return " ".join(kept)
+
+    def build(self, query, matches):
+        """
+        Args:
+            query (str): The user question.
+            matches (list): Retrieved hits with a "metadata" dict holding the passage text.
+
+        Returns:
+            str: The context, one "Page n :" passage per line.
+        """
+        query_terms = set(tokenize(query))
+        passages, remaining = [], self.max_tokens
+        matches = sorted(matches, key=lambda match: match["score"], reverse=True)
+
+        for position, match in enumerate(matches):
+            text = str(match["metadata"].get("metadata", ""))
+            label = PAGE_PREFIX.match(text)
+            label = label.group(0) if label else ""
+
+            remaining -= self.count_tokens(label)
+            if remaining <= 0:
+                break
+
+            sentences, matched = self.select_sentences(query_terms, text[len(label):])
+            budget = remaining if matched else remaining // (len(matches) - position)
+            passage = self.fit(sentences, budget)
+            if passage:
+                passages.append(label + passage)
+                remaining -= self.count_tokens(passage)
+
+        return "\n".join(passages)
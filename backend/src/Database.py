@@ -0,0 +1,73 @@
+import functools
+import inspect
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from src.Metrics import metrics
+
+
+def pool_settings():
+    """
+    Connection-pool options read from the environment.
+
+    Returns:
+        dict: Keyword arguments for the Mongo client.
+    """
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", 100)),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 60000)),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000)),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)),
+    }
+
+
+def create_client(uri=None):
+    """
+    Creates the async Mongo client used by every request handler and background job.
+
+    Operations are awaited, so a slow round trip only suspends the calling request
+    instead of blocking the event loop for all of them.
+    """
+    return AsyncIOMotorClient(uri or os.getenv("MONGO_URI"), **pool_settings())
+
+
+class LazyCollection:
+    """
+    Handle to a collection of the default database that creates the client on first use.
+
+    Attribute access is forwarded to the real Motor collection, so it can be used anywhere a
+    collection is expected while importing the application stays free of network setup
+    (DNS lookups of mongodb+srv URIs, monitor threads). Awaited operations are timed as
+    "mongo" spans labelled with the collection and the operation.
+
+    Args:
+        client (LazyResource): Lazily created Mongo client.
+        name (str): Collection name.
+    """
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    @property
+    def collection(self):
+        return self._client.get().get_default_database()[self._name]
+
+    async def _timed(self, operation, awaitable):
+        with metrics.span("mongo", collection=self._name, operation=operation):
+            return await awaitable
+
+    def __getattr__(self, attr):
+        value = getattr(self.collection, attr)
+        if not callable(value):
+            return value
+
+        @functools.wraps(value)
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            # Chỉ đo các thao tác được await (find_one, update_one, ...), cursor của find trả về nguyên vẹn
+            if inspect.isawaitable(result):
+                return self._timed(attr, result)
+            return result
+
+        return call
@@ -0,0 +1,373 @@
+import asyncio
+import inspect
+import json
+import os
+import shutil
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from src.Metrics import metrics
+
+class Checkpoint:
+    """
+    Item-level progress of one job stage, persisted as a JSON-lines file so a restarted
+    worker skips the items (pages, chunks, batches) that were already completed.
+    """
+
+    def __init__(self, job, stage, total=None):
+        self.job = job
+        self.stage = stage
+        self.total = total
+        self.path = os.path.join(job.work_dir, f"{stage}.jsonl")
+        self.done = {}
+        self._last_report = 0.0
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        # Dòng cuối có thể bị ghi dở khi worker chết
+                        continue
+                    self.done[item["key"]] = item["value"]
+
+    def get(self, key, default=None):
+        return self.done.get(str(key), default)
+
+    def __contains__(self, key):
+        return str(key) in self.done
+
+    async def save(self, key, value=True):
+        key = str(key)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+        self.done[key] = value
+
+        # Không cập nhật Mongo sau mỗi item, tối đa mỗi giây một lần
+        now = time.monotonic()
+        if now - self._last_report >= 1.0:
+            self._last_report = now
+            await self.job.update_stage(self.stage, "running", len(self.done), self.total)
+
+    async def finish(self):
+        await self.job.update_stage(self.stage, "done", len(self.done), self.total)
+
+
+class NullCheckpoint:
+    """
+    Checkpoint used when a pipeline runs outside of a job: keeps the items in memory for
+    the current run only.
+    """
+
+    def __init__(self):
+        self.done = {}
+
+    def get(self, key, default=None):
+        return self.done.get(str(key), default)
+
+    def __contains__(self, key):
+        return str(key) in self.done
+
+    async def save(self, key, value=True):
+        self.done[str(key)] = value
+
+    async def finish(self):
+        pass
+
+
+class NullJob:
+    """
+    Stand-in for JobContext so pipelines can be called directly from a request.
+
+    Stages always run and nothing is written to disk. Checkpoints still hold the items
+    saved during the run, since pipelines read their results back from the checkpoint
+    (e.g. llm_pipeline_quiz collects its questions with checkpoint.get).
+    """
+
+    async def run_stage(self, name, fn, *args):
+        result = fn(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def checkpoint(self, stage, total=None):
+        return NullCheckpoint()
+
+    async def update_stage(self, stage, status, done=None, total=None):
+        pass
+
+
+class JobContext:
+    """
+    Handle given to a job handler to report per-stage progress and resume completed stages.
+    """
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.job = job
+        self.id = job["_id"]
+        self.payload = job.get("payload", {})
+        self.work_dir = os.path.join(queue.work_dir, self.id)
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def stage_done(self, name):
+        return self.job.get("stages", {}).get(name, {}).get("status") == "done"
+
+    async def update_stage(self, stage, status, done=None, total=None):
+        state = {"status": status}
+        if done is not None:
+            state["done"] = done
+        if total is not None:
+            state["total"] = total
+        self.job.setdefault("stages", {})[stage] = state
+        await self.queue.update(self.id, {"stage": stage, f"stages.{stage}": state})
+
+    async def run_stage(self, name, fn, *args):
+        """
+        Runs a whole stage once. The JSON-serialisable output is kept in the work directory,
+        so the stage is skipped when the job is resumed.
+        """
+        path = os.path.join(self.work_dir, f"{name}.json")
+        if self.stage_done(name) and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        await self.update_stage(name, "running")
+        result = fn(*args)
+        if inspect.isawaitable(result):
+            result = await result
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        await self.update_stage(name, "done")
+        return result
+
+    async def checkpoint(self, stage, total=None):
+        checkpoint = Checkpoint(self, stage, total)
+        await self.update_stage(stage, "running", len(checkpoint.done), total)
+        return checkpoint
+
+
+class JobQueue:
+    """
+    Local worker pool running background jobs whose state is kept in a Mongo collection.
+
+    Jobs are claimed with a lease: a job whose worker crashed becomes claimable again once
+    the lease expires, and resumes from its completed stages.
+
+    Args:
+        collection: The async (Motor) Mongo collection holding job records.
+        workers (int): Number of concurrent workers in this process.
+        work_dir (str): Folder for stage outputs and checkpoints.
+        lease_seconds (int): How long a claim stays valid without progress.
+    """
+
+    def __init__(self, collection, workers=2, work_dir=os.path.join("cache", "jobs"), lease_seconds=600):
+        self.collection = collection
+        self.workers = workers
+        self.work_dir = work_dir
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers = {}
+        self._queue = None
+        self._tasks = []
+        self._listeners = {}
+        self._running = set()
+        # Id đang nằm trong hàng đợi: reaper quét lại không xếp trùng
+        self._enqueued = set()
+
+    def handler(self, kind):
+        """
+        Decorator registering the coroutine that runs jobs of the given kind.
+        """
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def _enqueue(self, job_id):
+        if job_id in self._enqueued:
+            return
+        self._enqueued.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._enqueued = set()
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        # Nhận lại các job còn dang dở (chưa chạy hoặc worker cũ đã chết)
+        async for job in self.collection.find({"status": {"$in": ["queued", "running"]}}, {"_id": 1}):
+            self._enqueue(job["_id"])
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind, payload, username):
+        """
+        Records a new job and schedules it. Returns the job id immediately.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        now = datetime.utcnow()
+        job_id = uuid.uuid4().hex
+        await self.collection.insert_one({
+            "_id": job_id,
+            "kind": kind,
+            "username": username,
+            "payload": payload,
+            "status": "queued",
+            "stage": None,
+            "stages": {},
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        })
+        self._enqueue(job_id)
+        return job_id
+
+    async def get(self, job_id):
+        return await self.collection.find_one({"_id": job_id})
+
+    async def update(self, job_id, fields):
+        fields["updated_at"] = datetime.utcnow()
+        fields["lease_until"] = fields["updated_at"] + timedelta(seconds=self.lease_seconds)
+        await self.collection.update_one({"_id": job_id}, {"$set": fields})
+        self._publish(job_id)
+
+    async def _claim(self, job_id):
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {
+                "_id": job_id,
+                "$or": [
+                    {"status": "queued"},
+                    {"status": "running", "lease_until": {"$lt": now}},
+                ],
+            },
+            {"$set": {
+                "status": "running",
+                "worker": self.worker_id,
+                "updated_at": now,
+                "lease_until": now + timedelta(seconds=self.lease_seconds),
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._enqueued.discard(job_id)
+            try:
+                # Job đang chạy trong chính process này thì không nhận lại
+                if job_id in self._running:
+                    continue
+                job = await self._claim(job_id)
+                if job:
+                    self._running.add(job_id)
+                    try:
+                        await self._run(job)
+                    finally:
+                        self._running.discard(job_id)
+            except Exception as e:
+                print(f"Job {job_id} worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _reaper(self):
+        # Định kỳ nhận lại các job có worker đã chết (lease hết hạn) và các job queued bị
+        # kẹt lâu (vd. _claim lỗi nên job bị bỏ khỏi hàng đợi mà vẫn queued)
+        while True:
+            await asyncio.sleep(self.lease_seconds / 2)
+            now = datetime.utcnow()
+            expired = self.collection.find(
+                {"$or": [
+                    {"status": "running", "lease_until": {"$lt": now}},
+                    {"status": "queued", "updated_at": {"$lt": now - timedelta(seconds=self.lease_seconds)}},
+                ]},
+                {"_id": 1},
+            )
+            async for job in expired:
+                self._enqueue(job["_id"])
+
+    async def _heartbeat(self, job_id):
+        # Gia hạn lease trong các stage dài không có tiến độ từng item
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self.collection.update_one(
+                {"_id": job_id, "worker": self.worker_id},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}},
+            )
+
+    async def _run(self, job):
+        context = JobContext(self, job)
+        self._publish(job["_id"])
+        heartbeat = asyncio.create_task(self._heartbeat(job["_id"]))
+        try:
+            # Mỗi job là một trace: các span của pipeline được ghi vào đó
+            with metrics.trace("job", job_id=job["_id"], kind=job["kind"]), metrics.span("job", kind=job["kind"]):
+                result = await self.handlers[job["kind"]](context)
+        except asyncio.CancelledError:
+            # Tắt server: để job ở trạng thái running, sẽ được nhận lại khi khởi động
+            raise
+        except Exception as e:
+            metrics.inc("jobs", kind=job["kind"], status="failed")
+            await self.update(job["_id"], {"status": "failed", "error": str(e)})
+            # Job failed không được chạy lại, bỏ luôn các output stage
+            shutil.rmtree(context.work_dir, ignore_errors=True)
+            return
+        finally:
+            heartbeat.cancel()
+
+        metrics.inc("jobs", kind=job["kind"], status="done")
+        await self.update(job["_id"], {"status": "done", "result": result})
+        shutil.rmtree(context.work_dir, ignore_errors=True)
+
+    def _publish(self, job_id):
+        for listener in self._listeners.get(job_id, ()):
+            listener.set()
+
+    async def events(self, job_id, poll_interval=2.0):
+        """
+        Yields the job record every time it changes, until it is done or failed.
+
+        Local updates wake the stream immediately; the record is also re-read every
+        poll_interval seconds so jobs run by another process are followed too.
+        """
+        listener = asyncio.Event()
+        self._listeners.setdefault(job_id, set()).add(listener)
+        last_update = None
+        try:
+            while True:
+                job = await self.get(job_id)
+                if job is None:
+                    return
+                if job["updated_at"] != last_update:
+                    last_update = job["updated_at"]
+                    yield job
+                if job["status"] in ("done", "failed"):
+                    return
+
+                try:
+                    await asyncio.wait_for(listener.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                listener.clear()
+        finally:
+            self._listeners[job_id].discard(listener)
+            if not self._listeners[job_id]:
+                del self._listeners[job_id]
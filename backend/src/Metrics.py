@@ -0,0 +1,246 @@
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Biên (giây) của histogram thời gian: từ truy vấn Mongo vài ms tới OCR cả tài liệu vài phút
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Trace của request/job đang chạy, được chép sang các thread của compute pool
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def metric_name(*parts):
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", "_".join(str(part) for part in parts if part != ""))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def flatten_stats(stats, *prefix):
+    """
+    Turns a nested stats dict (as returned by the various .stats() methods) into
+    (metric name, value) pairs. Booleans become 0/1, non-numeric values are skipped.
+    """
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from flatten_stats(value, *prefix, key)
+        elif isinstance(value, bool):
+            yield metric_name(*prefix, key), int(value)
+        elif isinstance(value, (int, float)):
+            yield metric_name(*prefix, key), value
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Trace:
+    """
+    Spans and counters recorded while serving one request or running one job.
+    """
+
+    def __init__(self, name, **attributes):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.start_time = time.time()
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, offset, seconds, error=None, **labels):
+        span = {"stage": stage, "offset": round(offset, 6), "seconds": round(seconds, 6), **labels}
+        if error:
+            span["error"] = error
+        with self._lock:
+            self.spans.append(span)
+
+    def add_count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "trace_id": self.id,
+                "name": self.name,
+                **self.attributes,
+                "start": self.start_time,
+                "seconds": round(time.perf_counter() - self.started, 6),
+                "spans": list(self.spans),
+                "counters": dict(self.counters),
+            }
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and latency histograms, exposed in the Prometheus text format.
+
+    Spans time a pipeline stage into the `<prefix>_stage_seconds` histogram; when a trace is
+    active (one request or one background job) the span and the counters are also recorded
+    in it, and the finished trace can be written as one JSON line.
+
+    Args:
+        prefix (str): Prefix of every metric name.
+        buckets (tuple): Upper bounds of the latency histograms, in seconds.
+        trace_log (str): "" to disable trace logs, "-" for stdout, otherwise a file path.
+        trace_min_seconds (float): Only log traces at least this slow.
+    """
+
+    def __init__(self, prefix="app", buckets=DEFAULT_BUCKETS, trace_log="", trace_min_seconds=0.0):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.trace_log = trace_log
+        self.trace_min_seconds = trace_min_seconds
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds value to the counter `<prefix>_<name>_total`.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_count(name, value)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """
+        Times the enclosed block as one occurrence of a stage. Usable around awaits.
+        """
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe("stage_seconds", seconds, stage=stage, **labels)
+            if error:
+                self.inc("stage_errors", stage=stage, **labels)
+
+            trace = current_trace.get()
+            if trace is not None:
+                trace.add_span(stage, started - trace.started, seconds, error, **labels)
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """
+        Makes a new trace current for the enclosed block and logs it when the block ends.
+
+        Yields:
+            Trace: The active trace.
+        """
+        trace = Trace(name, **attributes)
+        token = current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            current_trace.reset(token)
+            self.log_trace(trace)
+
+    def log_trace(self, trace):
+        if not self.trace_log:
+            return
+        record = trace.to_dict()
+        if record["seconds"] < self.trace_min_seconds:
+            return
+
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._log_lock:
+            if self.trace_log == "-":
+                print(line, file=sys.stdout, flush=True)
+            else:
+                with open(self.trace_log, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+
+    def render(self, gauges=None):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Args:
+            gauges (dict): Optional nested stats dict exported as `<prefix>_...` gauges.
+
+        Returns:
+            str: The exposition text.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(h.counts), h.count, h.sum)) for key, h in self._histograms.items()
+            )
+
+        lines = []
+        typed = set()
+
+        for (name, labels), value in counters:
+            full_name = metric_name(self.prefix, name, "total")
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append(f"# TYPE {full_name} counter")
+            lines.append(f"{full_name}{format_labels(labels)} {value}")
+
+        for (name, labels), (counts, count, total) in histograms:
+            full_name = metric_name(self.prefix, name)
+            if full_name not in typed:
+                typed.add(full_name)
+                lines.append(f"# TYPE {full_name} histogram")
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{full_name}_bucket{format_labels(labels + (('le', bound),))} {bucket_count}")
+            lines.append(f"{full_name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{full_name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{full_name}_count{format_labels(labels)} {count}")
+
+        for name, value in flatten_stats(gauges or {}, self.prefix):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(
+    prefix=os.getenv("METRICS_PREFIX", "quizapp"),
+    trace_log=os.getenv("TRACE_LOG", ""),
+    trace_min_seconds=float(os.getenv("TRACE_MIN_SECONDS", 0)),
+)
@@ -0,0 +1,211 @@
+import io
+import os
+from concurrent.futures import as_completed
+from dotenv import load_dotenv
+from src.Cache import DiskCache, content_hash
+from src.Compute import compute
+from src.Metrics import metrics
+
+load_dotenv()
+
+# Pytesseract config
+tesseract_cmd = os.getenv("TESSERACT_CMD", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+
+# Ảnh nhỏ hơn ngưỡng này (icon, đường kẻ, nền) bị bỏ qua
+ocr_min_image_side = int(os.getenv("OCR_MIN_IMAGE_SIDE", 32))
+ocr_min_image_area = int(os.getenv("OCR_MIN_IMAGE_AREA", 4096))
+
+# Cache content hash -> text, dùng lại giữa các lần upload
+ocr_cache = DiskCache(os.getenv("OCR_CACHE_DIR", os.path.join("cache", "ocr")))
+
+
+def ocr_image_bytes(image_bytes):
+    """
+    Runs Tesseract on an encoded image. Executed inside the compute process pool.
+    """
+    # Import trong worker: tiến trình web không phải nạp pytesseract và PIL khi khởi động
+    import pytesseract
+    from PIL import Image
+
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    return pytesseract.image_to_string(Image.open(io.BytesIO(image_bytes)))
+
+
+def is_ocr_candidate(width, height):
+    return (
+        width >= ocr_min_image_side
+        and height >= ocr_min_image_side
+        and width * height >= ocr_min_image_area
+    )
+
+
+def extract_text_from_image(images):
+    """
+    OCR a set of unique images, reusing cached results.
+
+    Args:
+        images (dict): content hash -> encoded image bytes.
+
+    Returns:
+        dict: content hash -> OCR text.
+    """
+    image_text = {}
+    pending = {}
+
+    for image_hash, image_bytes in images.items():
+        cached = ocr_cache.get(image_hash)
+        if cached is not None:
+            image_text[image_hash] = cached
+        else:
+            pending[image_hash] = image_bytes
+
+    metrics.inc("ocr_cache_hits", len(image_text))
+    metrics.inc("ocr_images", len(pending))
+
+    if len(pending) == 1:
+        # Một ảnh thì không cần gửi qua process pool
+        (image_hash, image_bytes), = pending.items()
+        results = [(image_hash, ocr_image_bytes(image_bytes))]
+    else:
+        # OCR song song trên process pool dùng chung
+        futures = {compute.submit_cpu(ocr_image_bytes, image_bytes): image_hash for image_hash, image_bytes in pending.items()}
+        results = ((futures[future], future.result()[1]) for future in as_completed(futures))
+
+    # Ghi cache ngay khi từng ảnh xong: job bị dừng giữa chừng không phải OCR lại các ảnh đã xong
+    for image_hash, text in results:
+        ocr_cache.set(image_hash, text)
+        image_text[image_hash] = text
+
+    return image_text
+
+
+def extract_text_from_table(page, table_count=1):
+    """
+    Extract the tables found on a single page.
+
+    Args:
+        page (fitz.Page): The page to search for tables.
+        table_count (int): Number of the first table on this page.
+
+    Returns:
+        tuple: (list of "(Table n):" texts, next table number)
+    """
+    table_text = []
+
+    for table in page.find_tables().tables:
+        rows = ["\t".join(cell or "" for cell in row) for row in table.extract()]
+        table_text.append(f"(Table {table_count}):\n" + "\n".join(rows))
+        table_count += 1
+
+    return table_text, table_count
+
+
+def iter_pdf_pages(file_path, images=True, tables=True, pages=None):
+    """
+    Walk a PDF once and yield the text, image and table payloads of each page.
+
+    Every image xref is decoded at most once; images below the size threshold are skipped.
+    Tables are numbered within their page, so a page yields the same payload whatever the
+    other pages contain.
+
+    Args:
+        file_path (str): Path to the PDF file.
+        images (bool): Whether to collect embedded images.
+        tables (bool): Whether to extract tables.
+        pages (set): Page numbers to read, None for all of them.
+
+    Yields:
+        dict: {"page_number", "text", "images", "new_images", "tables"} for every page (1-based).
+            "images" lists the content hashes of the page's images, "new_images" maps the hashes
+            seen for the first time on this page to their bytes.
+    """
+    import fitz
+
+    doc = fitz.open(file_path)
+    xref_hashes = {}
+    seen_hashes = set()
+
+    try:
+        for page in doc:
+            if pages is not None and page.number + 1 not in pages:
+                continue
+
+            page_images, new_images, table_text = [], {}, []
+
+            if images:
+                for img in page.get_images(full=True):
+                    xref, width, height = img[0], img[2], img[3]
+                    if not is_ocr_candidate(width, height):
+                        continue
+
+                    if xref not in xref_hashes:
+                        image_bytes = doc.extract_image(xref)["image"]
+                        image_hash = content_hash(image_bytes)
+                        xref_hashes[xref] = image_hash
+                        if image_hash not in seen_hashes:
+                            seen_hashes.add(image_hash)
+                            new_images[image_hash] = image_bytes
+
+                    page_images.append(xref_hashes[xref])
+
+            if tables:
+                with metrics.span("tables"):
+                    table_text, _ = extract_text_from_table(page)
+
+            yield {
+                "page_number": page.number + 1,
+                "text": page.get_text(),
+                "images": page_images,
+                "new_images": new_images,
+                "tables": table_text,
+            }
+    finally:
+        doc.close()
+
+
+def extract_pdf(file_path, images=True, tables=True, pages=None):
+    """
+    Extract a PDF in a single pass, then OCR its unique images in parallel.
+
+    Args:
+        pages (set): Page numbers to extract, None for the whole document.
+
+    Returns:
+        dict: page_number -> {"page_number", "text", "images", "tables"} where "images"
+            holds the "(Image n):" OCR texts of the page, numbered within the page.
+    """
+    extracted = {}
+    unique_images = {}
+
+    for page in iter_pdf_pages(file_path, images, tables, pages):
+        unique_images.update(page.pop("new_images"))
+        extracted[page["page_number"]] = page
+    # Đếm ở đây thay vì trong iter_pdf_pages: fingerprint_pages cũng đọc lại các trang
+    metrics.inc("pdf_pages", len(extracted))
+
+    image_text = {}
+    if unique_images:
+        with metrics.span("ocr"):
+            image_text = extract_text_from_image(unique_images)
+
+    for page in extracted.values():
+        page["images"] = [
+            f"(Image {img_count}):\n" + image_text[image_hash]
+            for img_count, image_hash in enumerate(page["images"], start=1)
+        ]
+
+    return extracted
+
+
+def fingerprint_pages(file_path):
+    """
+    Hashes what the chat pipeline reads from each page (its text and the bytes of its
+    images) without running OCR or table extraction.
+
+    Returns:
+        dict: page_number -> sha256 hex digest.
+    """
+    return {
+        page["page_number"]: content_hash("\n".join([page["text"], *page["images"]]))
+        for page in iter_pdf_pages(file_path, images=True, tables=False)
+    }
@@ -2,4 +2,26 @@ TrueOrFalseQuestion = '{"question": The question , "options": ["True", "False"],
 SingleChoiceQuestion = '{"question": The question, "options": An array of 4 strings representing the choices, "answer": The number corresponding to the index of the correct answer in the options array}'
 
 ExTrueOrFalseQuestion = '{"question": "HTML is a programming language.", "options": ["True", "False"], "answer": false}'
-ExSingleChoiceQuestion = '{"question": "Which of the following is the correct translation of house in Spanish?", "options": ["Casa", "Maison", "Haus", "Huis"], "answer": 0}'
\ No newline at end of file
+ExSingleChoiceQuestion = '{"question": "Which of the following is the correct translation of house in Spanish?", "options": ["Casa", "Maison", "Haus", "Huis"], "answer": 0}'
+
+ChatPrompt = """Context:
+{context}
+
+User Query:
+{query}
+
+Instructions:
+1. Provide a clear and concise response to the user's query based on the provided context.
+2. Ensure the response is formatted for display in a report, not includes any specific character like (**) and adhering to react-markdown syntax.
+3. If additional information is required or the query cannot be answered fully, provide a helpful and polite clarification to the user 
+
+Example format:
+Respond by saying that the answer to the question has been found, and smoothly lead into the answer
+1. Any subtitle
+2. Next subtitle
+3. ....
+Consume and condition!
+Additionally, offer related follow-up questions to guide the user further. 
+
+Response:
+"""
@@ -1,16 +1,30 @@
 from langchain.prompts import PromptTemplate
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
 import json
+import asyncio
+from google.api_core import exceptions as google_exceptions
+from src.RateLimiter import RateLimiter
+from src.Resources import resources
+from src.Metrics import metrics
+from src.Cache import DiskCache, content_hash
 
 # Load API key from .env file 
 load_dotenv()
 gemini_api_key = os.getenv("GEMINI_API_KEY")
+gemini_model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
 
-# Configure the Generative AI model
-genai.configure(api_key=gemini_api_key)
-model = genai.GenerativeModel("gemini-1.5-flash")
+# Configure the Generative AI model (tạo khi dùng lần đầu, không phải lúc import)
+def load_model():
+    import google.generativeai as genai
+
+    genai.configure(api_key=gemini_api_key)
+    return genai.GenerativeModel(gemini_model_name)
+
+gemini_model = resources.register("gemini_model", load_model)
+
+def get_model():
+    return gemini_model.get()
 
 # Define the prompt template
 prompt_template = """
@@ -50,41 +64,165 @@ question_prompt = PromptTemplate(
     input_variables=["text"]
 )
 
-def generate_question_from_chunks(text):
+# Phiên bản prompt lấy theo nội dung template: sửa prompt thì câu hỏi đã cache không còn được dùng
+prompt_version = content_hash(prompt_template)[:12]
+
+# Cache câu hỏi đã sinh theo (phiên bản prompt, model, hash của chunk), giới hạn số file trên đĩa
+question_cache = DiskCache(
+    os.getenv("QUESTION_CACHE_DIR", os.path.join("cache", "questions")),
+    max_entries=int(os.getenv("QUESTION_CACHE_SIZE", 50000)),
+)
+
+def question_cache_key(text):
+    return content_hash(f"{prompt_version}:{gemini_model_name}:{content_hash(text)}")
+
+def cached_questions(text):
+    questions = question_cache.get(question_cache_key(text))
+    if questions is not None:
+        metrics.inc("question_cache_hits")
+    return questions
+
+def store_questions(text, questions):
+    # Chỉ lưu kết quả hợp lệ, lỗi (chuỗi thông báo) và phản hồi không có câu hỏi sẽ được thử lại lần sau
+    if isinstance(questions, list):
+        question_cache.set(question_cache_key(text), questions)
+
+# Giới hạn song song và ngân sách request/token mỗi phút của Gemini
+quiz_concurrency = int(os.getenv("QUIZ_CONCURRENCY", 4))
+gemini_requests_per_minute = int(os.getenv("GEMINI_RPM", 15))
+gemini_tokens_per_minute = int(os.getenv("GEMINI_TPM", 1000000))
+gemini_max_retries = int(os.getenv("GEMINI_MAX_RETRIES", 3))
+gemini_retry_backoff = float(os.getenv("GEMINI_RETRY_BACKOFF", 2.0))
+
+rate_limiter = RateLimiter(gemini_requests_per_minute, gemini_tokens_per_minute)
+
+# Lỗi tạm thời nên thử lại (quá hạn mức, server quá tải, timeout)
+TRANSIENT_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+def parse_questions(response):
+    """
+    Extracts the JSON question array from a model response.
+
+    Args:
+        response: The GenerateContentResponse returned by the model.
+
+    Returns:
+        list: Parsed questions, or None when no array was found.
+    """
+    # Extract the content of the response
+    response = response.candidates[0].content.parts[0].text
+    # Tìm vị trí của ký tự bắt đầu trong chuỗi
+    start_index = response.find("[")
+    end_index = response.find("}]")
+    # Kiểm tra xem ký tự có tồn tại trong chuỗi không
+    if start_index != -1:
+        result = response[start_index:end_index-4]
+        quiz_json = json.loads(result)
+        return quiz_json
+
+def estimate_tokens(text):
+    # Ước lượng thô: khoảng 4 ký tự cho mỗi token
+    return len(text) // 4 + 1
+
+def generate_question_from_chunks(text, fresh=False):
     """
     Generates questions based on the input text chunk.
 
     Args:
         text (str): The text chunk to generate questions from.
+        fresh (bool): Ignore the questions cached for this chunk.
 
     Returns:
         str: Generated questions in JSON format.
     """
+    questions = None if fresh else cached_questions(text)
+    if questions is not None:
+        return questions
+
     try:
         # Format the prompt using the input text
         formatted_prompt = question_prompt.format(text=text)
+        metrics.inc("gemini_requests", kind="quiz")
+        metrics.inc("gemini_prompt_tokens", estimate_tokens(formatted_prompt), kind="quiz")
         # Generate questions using the model
-        response = model.generate_content(formatted_prompt)
-
-        # Extract the content of the response
-        response =response.candidates[0].content.parts[0].text
-        # Tìm vị trí của ký tự bắt đầu trong chuỗi
-        start_index = response.find("[")
-        end_index = response.find("}]")
-        # Kiểm tra xem ký tự có tồn tại trong chuỗi không
-        if start_index != -1:
-            result = response[start_index:end_index-4]
-            quiz_json = json.loads(result)
-            return quiz_json
+        with metrics.span("gemini", kind="quiz"):
+            response = get_model().generate_content(formatted_prompt)
+        questions = parse_questions(response)
+        store_questions(text, questions)
+        return questions
     except Exception as e:
         return str(e)
-input_text = """
-HTML is a markup language used for structuring content on the web.
 
-CSS (Cascading Style Sheets) is a style sheet language used to describe the presentation of a document written in HTML or XML (including XML-based languages such as SVG or XHTML). CSS enables developers to control the layout, design, and visual appearance of web pages, including aspects like colors, fonts, spacing, alignment, and animations..
-"""
+async def generate_question_from_chunks_async(text, fresh=False):
+    """
+    Async variant of generate_question_from_chunks that respects the shared rate limiter
+    and retries transient Gemini failures with exponential backoff.
+
+    Args:
+        text (str): The text chunk to generate questions from.
+        fresh (bool): Ignore the questions cached for this chunk.
+
+    Returns:
+        list | str: Parsed questions, or the error message on failure.
+    """
+    questions = None if fresh else cached_questions(text)
+    if questions is not None:
+        return questions
+
+    formatted_prompt = question_prompt.format(text=text)
+    tokens = estimate_tokens(formatted_prompt)
+
+    for attempt in range(gemini_max_retries + 1):
+        with metrics.span("gemini_rate_limit"):
+            await rate_limiter.acquire(tokens)
+        metrics.inc("gemini_requests", kind="quiz")
+        metrics.inc("gemini_prompt_tokens", tokens, kind="quiz")
+        try:
+            with metrics.span("gemini", kind="quiz"):
+                response = await get_model().generate_content_async(formatted_prompt)
+            questions = parse_questions(response)
+            store_questions(text, questions)
+            return questions
+        except TRANSIENT_ERRORS as e:
+            metrics.inc("gemini_retries", kind="quiz")
+            if attempt == gemini_max_retries:
+                return str(e)
+            await asyncio.sleep(gemini_retry_backoff * 2 ** attempt)
+        except Exception as e:
+            return str(e)
+
+async def generate_questions_concurrently(chunks, concurrency=None, on_result=None, fresh=False):
+    """
+    Generates questions for many chunks with at most `concurrency` requests in flight.
+    Chunks found in the question cache are answered without a request.
+
+    Args:
+        chunks (list): Text chunks to generate questions from.
+        concurrency (int): Parallelism limit, defaults to QUIZ_CONCURRENCY.
+        on_result (callable): Optional coroutine called with (index, result) as each chunk finishes.
+        fresh (bool): Ignore the cached questions and call the model for every chunk.
+
+    Returns:
+        list: One result per chunk, in chunk order.
+    """
+    semaphore = asyncio.Semaphore(concurrency or quiz_concurrency)
+
+    async def generate(index, text):
+        # Chunk đã có trong cache không phải chờ lượt gọi model (đã tra cache nên bên trong không tra lại)
+        result = None if fresh else cached_questions(text)
+        if result is None:
+            async with semaphore:
+                result = await generate_question_from_chunks_async(text, fresh=True)
+        if on_result:
+            await on_result(index, result)
+        return result
+
+    return await asyncio.gather(*(generate(i, text) for i, text in enumerate(chunks)))
 
-quiz = generate_question_from_chunks(input_text)
-print(quiz)
 # Export the function for use in app.py
-__all__ = ["generate_question_from_chunks, model"]
\ No newline at end of file
+__all__ = ["generate_question_from_chunks", "generate_questions_concurrently", "get_model", "question_cache"]
\ No newline at end of file
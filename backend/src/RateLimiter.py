@@ -0,0 +1,47 @@
+import asyncio
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Sliding one-minute window limiting both request count and token volume.
+
+    Args:
+        requests_per_minute (int): Maximum requests started in any 60 second window.
+        tokens_per_minute (int): Maximum estimated tokens sent in any 60 second window.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._events = deque()  # (timestamp, tokens)
+        self._tokens = 0
+        self._lock = asyncio.Lock()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= self.window:
+            _, tokens = self._events.popleft()
+            self._tokens -= tokens
+
+    def _fits(self, tokens):
+        if len(self._events) >= self.requests_per_minute:
+            return False
+        # Một request lớn hơn cả ngân sách vẫn được chạy khi cửa sổ trống
+        return not self._events or self._tokens + tokens <= self.tokens_per_minute
+
+    async def acquire(self, tokens=0):
+        """
+        Waits until a request of the given token size fits in both budgets.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if self._fits(tokens):
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                # Chờ tới khi sự kiện cũ nhất rời khỏi cửa sổ
+                await asyncio.sleep(self.window - (now - self._events[0][0]))
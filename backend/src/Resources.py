@@ -0,0 +1,94 @@
+import threading
+import time
+
+
+class LazyResource:
+    """
+    A heavy client or model created on first use instead of at import time.
+
+    Creation is guarded by a lock so concurrent first callers build it only once; the time
+    it took is recorded for the startup report.
+
+    Args:
+        name (str): Name used for warm-up and stats.
+        factory (callable): Builds the resource, called without arguments.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.load_seconds = None
+        self.loaded_at = None
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+
+        with self._lock:
+            if not self._loaded:
+                started = time.perf_counter()
+                self._value = self.factory()
+                self.load_seconds = time.perf_counter() - started
+                self.loaded_at = time.time()
+                self._loaded = True
+        return self._value
+
+    def stats(self):
+        return {"loaded": self._loaded, "load_seconds": self.load_seconds}
+
+
+class ResourceRegistry:
+    """
+    Keeps every lazy resource of the process so they can be warmed up and reported together.
+    """
+
+    def __init__(self):
+        self._resources = {}
+        self.timings = {}
+
+    def register(self, name, factory):
+        resource = LazyResource(name, factory)
+        self._resources[name] = resource
+        return resource
+
+    def names(self):
+        return list(self._resources)
+
+    def warm_up(self, names=None):
+        """
+        Loads the given resources (all of them by default), skipping unknown names.
+
+        Args:
+            names (list): Resource names to load.
+
+        Returns:
+            dict: name -> seconds spent loading it.
+        """
+        loaded = {}
+        for name in names or self.names():
+            resource = self._resources.get(name)
+            if resource is None:
+                continue
+            resource.get()
+            loaded[name] = resource.load_seconds
+        return loaded
+
+    def record(self, name, seconds):
+        # Thời gian của một bước khởi động (import, tạo index, warm-up...)
+        self.timings[name] = seconds
+
+    def stats(self):
+        return {
+            "timings": dict(self.timings),
+            "resources": {name: resource.stats() for name, resource in self._resources.items()},
+        }
+
+
+resources = ResourceRegistry()
@@ -0,0 +1,261 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from urllib.parse import quote
+
+# Token giữ nguyên định danh và công thức như "np.dot", "max_seq_length", "x-ray"
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-]\w+)*")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were "
+    "what when where which who why how with do does did can could should would will not no".split()
+)
+
+# Tiền tố số trang trong metadata của chunk
+PAGE_PREFIX = re.compile(r"^Page \d+ :")
+
+
+def tokenize(text):
+    """
+    Lower-cased terms of a text. Compound identifiers are kept whole and also split into
+    their parts, so both "np.dot" and "dot" match.
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        parts = re.split(r"[.\-_]", token)
+        if len(parts) > 1:
+            terms += [part for part in parts if part and part not in STOPWORDS]
+    return terms
+
+
+def shingles(text, size=3):
+    words = text.lower().split()
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+class KeywordIndex:
+    """
+    Per-namespace BM25 inverted index, kept on disk next to the vector index.
+
+    Each namespace is a JSON file holding the postings (term -> {id: term frequency}), the
+    document lengths and the metadata returned with a hit. Loaded namespaces stay in memory
+    until the file changes.
+
+    Args:
+        directory (str): Folder holding one file per namespace.
+        k1 (float): BM25 term-frequency saturation.
+        b (float): BM25 length normalisation.
+    """
+
+    def __init__(self, directory, k1=1.5, b=0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, namespace):
+        return os.path.join(self.directory, quote(namespace or "__default__", safe="") + ".json")
+
+    def _load(self, namespace):
+        path = self._path(namespace)
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            return {"postings": {}, "lengths": {}, "metadata": {}}
+
+        # Tiến trình khác có thể đã ghi lại file: đọc lại khi mtime thay đổi
+        loaded = self._namespaces.get(namespace)
+        if loaded is not None and loaded[0] == mtime:
+            return loaded[1]
+
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self._namespaces[namespace] = (mtime, index)
+        return index
+
+    def _save(self, namespace, index):
+        path = self._path(namespace)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._namespaces.pop(namespace, None)
+
+    @staticmethod
+    def _remove(index, doc_id):
+        if doc_id not in index["lengths"]:
+            return
+        for term in set(index["metadata"][doc_id].get("terms", [])):
+            postings = index["postings"].get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del index["postings"][term]
+        del index["lengths"][doc_id]
+        del index["metadata"][doc_id]
+
+    def upsert(self, documents, namespace):
+        """
+        Adds or replaces documents.
+
+        Args:
+            documents (list): (id, text, metadata) tuples.
+            namespace (str): Namespace of the documents.
+        """
+        if not documents:
+            return
+
+        with self._lock:
+            index = self._load(namespace)
+            for doc_id, text, metadata in documents:
+                self._remove(index, doc_id)
+                counts = Counter(tokenize(text))
+                for term, count in counts.items():
+                    index["postings"].setdefault(term, {})[doc_id] = count
+                index["lengths"][doc_id] = sum(counts.values())
+                index["metadata"][doc_id] = {**metadata, "terms": list(counts)}
+            self._save(namespace, index)
+
+    def delete(self, ids, namespace):
+        ids = set(ids)
+        if not ids:
+            return
+
+        with self._lock:
+            index = self._load(namespace)
+            for doc_id in ids:
+                self._remove(index, doc_id)
+            self._save(namespace, index)
+
+    def delete_namespace(self, namespace):
+        with self._lock:
+            self._namespaces.pop(namespace, None)
+            try:
+                os.remove(self._path(namespace))
+            except FileNotFoundError:
+                pass
+
+    def query(self, text, top_k, namespace):
+        """
+        Ranks the documents of a namespace against a query with BM25.
+
+        Returns:
+            dict: {"matches": [{"id", "score", "metadata"}, ...]} like VectorStore.query.
+        """
+        index = self._load(namespace)
+        lengths = index["lengths"]
+        if not lengths:
+            return {"matches": []}
+
+        total = len(lengths)
+        avg_length = sum(lengths.values()) / total
+        scores = Counter()
+
+        for term in set(tokenize(text)):
+            postings = index["postings"].get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return {
+            "matches": [
+                {
+                    "id": doc_id,
+                    "score": score,
+                    "metadata": {k: v for k, v in index["metadata"][doc_id].items() if k != "terms"},
+                }
+                for doc_id, score in scores.most_common(top_k)
+            ]
+        }
+
+
+class HybridRetriever:
+    """
+    Dense + keyword retrieval fused with reciprocal rank fusion.
+
+    Both indexes are queried for `candidates` hits; hits under their score threshold are
+    dropped, the rest are fused by rank, and a hit whose text nearly repeats a better one
+    (overlapping chunks) is skipped.
+
+    Args:
+        get_vector_store (callable): Returns the VectorStore to query.
+        keyword_index (KeywordIndex): BM25 index built at ingest time.
+        candidates (int): Hits taken from each index before fusion.
+        min_vector_score (float): Minimum cosine similarity of a dense hit.
+        min_keyword_score (float): Minimum BM25 score of a keyword hit.
+        rrf_k (int): Rank offset of reciprocal rank fusion.
+        dedup_threshold (float): Jaccard similarity of word shingles above which a hit is a duplicate.
+    """
+
+    def __init__(self, get_vector_store, keyword_index, candidates=20, min_vector_score=0.2,
+                 min_keyword_score=1.0, rrf_k=60, dedup_threshold=0.8):
+        self.get_vector_store = get_vector_store
+        self.keyword_index = keyword_index
+        self.candidates = candidates
+        self.min_vector_score = min_vector_score
+        self.min_keyword_score = min_keyword_score
+        self.rrf_k = rrf_k
+        self.dedup_threshold = dedup_threshold
+
+    def search(self, query, query_embedding, top_k, namespace):
+        """
+        Args:
+            query (str): The user question.
+            query_embedding (list): Its embedding.
+            top_k (int): Number of hits returned.
+            namespace (str): Namespace searched in both indexes.
+
+        Returns:
+            list: {"id", "score", "metadata", "vector_score", "keyword_score"} hits, best first.
+        """
+        dense = self.get_vector_store().query(
+            vector=query_embedding,
+            top_k=self.candidates,
+            namespace=namespace,
+            include_metadata=True,
+        )["matches"]
+        keyword = self.keyword_index.query(query, self.candidates, namespace)["matches"]
+
+        hits = {}
+        for source, matches, threshold in (
+            ("vector_score", dense, self.min_vector_score),
+            ("keyword_score", keyword, self.min_keyword_score),
+        ):
+            matches = [match for match in matches if match["score"] >= threshold]
+            for rank, match in enumerate(matches):
+                hit = hits.setdefault(match["id"], {
+                    "id": match["id"],
+                    "score": 0.0,
+                    "metadata": match["metadata"],
+                    "vector_score": None,
+                    "keyword_score": None,
+                })
+                hit["score"] += 1 / (self.rrf_k + rank + 1)
+                hit[source] = match["score"]
+
+        results, kept_shingles = [], []
+        for hit in sorted(hits.values(), key=lambda hit: hit["score"], reverse=True):
+            # Bỏ tiền tố "Page n :" để cùng một nội dung ở hai trang vẫn bị coi là trùng
+            hit_shingles = shingles(PAGE_PREFIX.sub("", str(hit["metadata"].get("metadata", ""))))
+            if any(
+                len(hit_shingles & other) / len(hit_shingles | other) >= self.dedup_threshold
+                for other in kept_shingles
+            ):
+                continue
+            kept_shingles.append(hit_shingles)
+            results.append(hit)
+            if len(results) == top_k:
+                break
+
+        return results
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import uuid
+
+
+class UploadTooLarge(Exception):
+    """
+    Raised when an upload exceeds the configured size cap.
+    """
+
+    def __init__(self, max_size):
+        super().__init__(f"File vượt quá dung lượng cho phép ({max_size} bytes)")
+        self.max_size = max_size
+
+
+class BlobStore:
+    """
+    Content-addressed storage of uploaded files.
+
+    Each distinct file is stored once as <directory>/<sha256>.pdf; per-user paths are hard
+    links to that blob (or copies where the filesystem cannot link).
+
+    Args:
+        directory (str): Folder holding the blobs.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def blob_path(self, sha256):
+        return os.path.join(self.directory, f"{sha256}.pdf")
+
+    async def save_upload(self, file, chunk_size=1024 * 1024, max_size=None):
+        """
+        Streams an UploadFile to disk in fixed-size chunks, hashing it on the way, and stores
+        it once by hash. File writes run in a worker thread so the event loop is never blocked.
+
+        The data goes to a temporary file that is renamed into place only when complete, so a
+        partially written upload is never visible to the processing pipeline.
+
+        Args:
+            file (UploadFile): The uploaded file.
+            chunk_size (int): Bytes read and written per step.
+            max_size (int): Optional cap in bytes; UploadTooLarge is raised past it.
+
+        Returns:
+            tuple: (sha256, blob path, size in bytes)
+        """
+        await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+        hasher = hashlib.sha256()
+        size = 0
+
+        tmp_path = os.path.join(self.directory, f".upload-{uuid.uuid4().hex}.tmp")
+        buffer = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            while chunk := await file.read(chunk_size):
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise UploadTooLarge(max_size)
+                hasher.update(chunk)
+                await asyncio.to_thread(buffer.write, chunk)
+            await asyncio.to_thread(buffer.close)
+        except BaseException:
+            buffer.close()
+            os.remove(tmp_path)
+            raise
+
+        sha256 = hasher.hexdigest()
+        blob_path = self.blob_path(sha256)
+
+        # File đã có trong kho thì bỏ bản vừa ghi
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, blob_path)
+
+        return sha256, blob_path, size
+
+    def link(self, sha256, path):
+        """
+        Points a per-user path at the stored blob, replacing whatever was there.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blob_path = self.blob_path(sha256)
+
+        # Đã trỏ tới đúng blob (rename giữa hai hard link cùng inode không làm gì)
+        if os.path.exists(path) and os.path.samefile(path, blob_path):
+            return
+
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, path)
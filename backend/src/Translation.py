@@ -0,0 +1,152 @@
+import asyncio
+import re
+from src.Cache import content_hash
+from src.Metrics import metrics
+
+# Ngăn cách các đoạn khi gộp nhiều đoạn vào một request dịch
+SEPARATOR = "\n\n|||\n\n"
+SEPARATOR_PATTERN = re.compile(r"\s*\|\s*\|\s*\|\s*")
+
+
+def detect_language(texts, sample_chunks=5, sample_chars=1000):
+    """
+    Detects the language of a whole document from a sample of its chunks.
+
+    Args:
+        texts (list): Chunks of the document.
+        sample_chunks (int): Number of evenly spaced chunks to sample.
+        sample_chars (int): Characters kept from each sampled chunk.
+
+    Returns:
+        str: ISO 639-1 code, or None when the sample holds no detectable text.
+    """
+    from langdetect import DetectorFactory, detect
+    from langdetect.lang_detect_exception import LangDetectException
+
+    # Kết quả langdetect ngẫu nhiên nếu không cố định seed
+    DetectorFactory.seed = 0
+
+    texts = [text for text in texts if text and text.strip()]
+    if not texts:
+        return None
+
+    step = max(1, len(texts) // sample_chunks)
+    sample = "\n".join(text[:sample_chars] for text in texts[::step][:sample_chunks])
+    try:
+        return detect(sample)
+    except LangDetectException:
+        return None
+
+
+class DocumentTranslator:
+    """
+    Translates the chunks of a document in as few provider requests as possible.
+
+    The language is detected once per document; chunks still in the source language are
+    packed into batches of at most `max_chars` characters, and batches are sent concurrently
+    with at most `concurrency` requests in flight. Every translation is kept in a persistent
+    cache keyed by the hash of the source text, so identical chunks are never sent twice.
+
+    Args:
+        get_client (callable): Returns the async googletrans Translator.
+        cache (DiskCache): Persistent cache of translations.
+        source (str): Language that gets translated.
+        dest (str): Target language.
+        max_chars (int): Character budget of one request.
+        concurrency (int): Maximum number of requests in flight.
+    """
+
+    def __init__(self, get_client, cache, source="vi", dest="en", max_chars=4500, concurrency=4):
+        self.get_client = get_client
+        self.cache = cache
+        self.source = source
+        self.dest = dest
+        self.max_chars = max_chars
+        self.concurrency = concurrency
+
+    def cache_key(self, text):
+        return content_hash(f"{self.source}:{self.dest}:{text}")
+
+    def make_batches(self, indexes, texts):
+        """
+        Groups chunk indexes so the joined text of a batch fits in max_chars.
+        A chunk longer than the budget gets a batch of its own.
+        """
+        batches, batch, size = [], [], 0
+        for i in indexes:
+            length = len(texts[i]) + len(SEPARATOR)
+            if batch and size + length > self.max_chars:
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(i)
+            size += length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def translate_one(self, text):
+        metrics.inc("translation_requests")
+        metrics.inc("translation_chars", len(text))
+        result = await self.get_client().translate(text, src=self.source, dest=self.dest)
+        return result.text
+
+    async def translate_batch(self, batch):
+        """
+        Translates several chunks in one request. If the provider does not give back one
+        part per chunk, falls back to a request per chunk.
+        """
+        if len(batch) > 1:
+            parts = SEPARATOR_PATTERN.split(await self.translate_one(SEPARATOR.join(batch)))
+            if len(parts) == len(batch):
+                return [part.strip() for part in parts]
+
+        return [await self.translate_one(text) for text in batch]
+
+    async def translate_many(self, texts, on_result=None):
+        """
+        Translates the chunks of one document.
+
+        Args:
+            texts (list): Chunks of the document, in order.
+            on_result (callable): Optional coroutine called with (index, translated text)
+                as each chunk becomes available.
+
+        Returns:
+            list: Translated chunks, in input order. Chunks in another language are
+                returned unchanged.
+        """
+        results = list(texts)
+
+        # Văn bản không phải ngôn ngữ nguồn thì giữ nguyên, không gửi request nào
+        with metrics.span("detect_language"):
+            language = detect_language(texts)
+        if language != self.source:
+            if on_result:
+                for i, text in enumerate(results):
+                    await on_result(i, text)
+            return results
+
+        pending = []
+        for i, text in enumerate(texts):
+            cached = self.cache.get(self.cache_key(text)) if text.strip() else text
+            if cached is None:
+                pending.append(i)
+                continue
+            results[i] = cached
+            if on_result:
+                await on_result(i, cached)
+        metrics.inc("translation_cache_hits", len(texts) - len(pending))
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(batch):
+            async with semaphore:
+                translated = await self.translate_batch([texts[i] for i in batch])
+            for i, text in zip(batch, translated):
+                self.cache.set(self.cache_key(texts[i]), text)
+                results[i] = text
+                if on_result:
+                    await on_result(i, text)
+
+        await asyncio.gather(*(run(batch) for batch in self.make_batches(pending, texts)))
+        return results
@@ -0,0 +1,258 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from urllib.parse import quote
+import numpy as np
+
+
+class VectorStore:
+    """
+    Common interface of the vector index backends.
+
+    Vectors are (id, values, metadata) tuples; query results are plain dicts:
+    {"matches": [{"id", "score", "metadata"}, ...]} sorted by decreasing score.
+    """
+
+    # Số vector tối đa mỗi lần upsert, None nếu backend nhận tất cả trong một lần
+    batch_size = None
+
+    def upsert(self, vectors, namespace):
+        raise NotImplementedError
+
+    def query(self, vector, top_k, namespace, include_metadata=True):
+        raise NotImplementedError
+
+    def delete(self, ids, namespace):
+        raise NotImplementedError
+
+    def delete_namespace(self, namespace):
+        raise NotImplementedError
+
+
+class PineconeVectorStore(VectorStore):
+    """
+    Remote Pinecone index.
+    """
+
+    def __init__(self, index, batch_size=100):
+        self.index = index
+        self.batch_size = batch_size
+
+    def upsert(self, vectors, namespace):
+        self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def query(self, vector, top_k, namespace, include_metadata=True):
+        results = self.index.query(
+            namespace=namespace,
+            vector=vector,
+            top_k=top_k,
+            include_metadata=include_metadata,
+        )
+        return {
+            "matches": [
+                {"id": match.id, "score": match.score, "metadata": match.metadata or {}}
+                for match in results.matches
+            ]
+        }
+
+    def delete(self, ids, namespace):
+        if ids:
+            self.index.delete(ids=list(ids), namespace=namespace)
+
+    def delete_namespace(self, namespace):
+        self.index.delete(delete_all=True, namespace=namespace)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process index keeping one memory-mapped matrix per namespace on disk.
+
+    Vectors are L2-normalised when stored so a dot product gives the cosine similarity, and
+    search is an exact matrix-vector product over the namespace.
+
+    Every write goes to a new version sub-folder (vectors.npy + index.json) and is published by
+    renaming a CURRENT pointer file, so readers always see the ids and the matrix of one version.
+
+    Args:
+        directory (str): Folder holding one sub-folder per namespace.
+        dtype (str): "float32" or "float16" storage for the matrix.
+    """
+
+    def __init__(self, directory, dtype="float32"):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, namespace):
+        return os.path.join(self.directory, quote(namespace or "__default__", safe=""))
+
+    def _current(self, path):
+        try:
+            with open(os.path.join(path, "CURRENT"), "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _load(self, namespace, retries=3):
+        """
+        Returns (matrix, ids, metadata, id -> row) for a namespace, memory-mapping the matrix.
+        """
+        path = self._path(namespace)
+        for attempt in range(retries):
+            version = self._current(path)
+            if version is None:
+                return None, [], [], {}
+
+            # Tiến trình khác có thể đã ghi phiên bản mới: đọc lại khi CURRENT thay đổi
+            loaded = self._namespaces.get(namespace)
+            if loaded is not None and loaded[0] == version:
+                return loaded[1]
+
+            try:
+                matrix = np.load(os.path.join(path, version, "vectors.npy"), mmap_mode="r")
+                with open(os.path.join(path, version, "index.json"), "r", encoding="utf-8") as f:
+                    index = json.load(f)
+            except FileNotFoundError:
+                # Phiên bản vừa bị thay thế và dọn đi sau khi đọc CURRENT: đọc lại con trỏ
+                if attempt == retries - 1:
+                    raise
+                continue
+
+            loaded = (matrix, index["ids"], index["metadata"], {vector_id: row for row, vector_id in enumerate(index["ids"])})
+            self._namespaces[namespace] = (version, loaded)
+            return loaded
+
+    def _save(self, namespace, matrix, ids, metadata):
+        path = self._path(namespace)
+
+        # Ghi cả matrix và index vào một thư mục phiên bản mới, chưa ai đọc tới
+        version = uuid.uuid4().hex
+        os.makedirs(os.path.join(path, version))
+        np.save(os.path.join(path, version, "vectors.npy"), matrix.astype(self.dtype))
+        with open(os.path.join(path, version, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "metadata": metadata}, f, ensure_ascii=False)
+
+        # Một lần rename duy nhất chuyển sang phiên bản mới
+        previous = self._current(path)
+        tmp_current = os.path.join(path, f"CURRENT.{version}.tmp")
+        with open(tmp_current, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_current, os.path.join(path, "CURRENT"))
+        self._namespaces.pop(namespace, None)
+
+        # Chỉ dọn phiên bản vừa bị thay (matrix đang được mmap vẫn đọc được sau khi xóa)
+        if previous and previous != version:
+            shutil.rmtree(os.path.join(path, previous), ignore_errors=True)
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def upsert(self, vectors, namespace):
+        if not vectors:
+            return
+
+        # Vector trùng id trong cùng một lần upsert: giữ bản cuối
+        updates = {vector_id: (values, vector_metadata) for vector_id, values, vector_metadata in vectors}
+
+        with self._lock:
+            matrix, ids, metadata, rows = self._load(namespace)
+            ids, metadata, rows = list(ids), list(metadata), dict(rows)
+
+            for vector_id in updates:
+                if vector_id not in rows:
+                    rows[vector_id] = len(ids)
+                    ids.append(vector_id)
+                    metadata.append(None)
+
+            dimension = len(next(iter(updates.values()))[0])
+            full = np.zeros((len(ids), dimension), dtype=np.float32)
+            if matrix is not None:
+                full[:len(matrix)] = matrix
+
+            for vector_id, (values, vector_metadata) in updates.items():
+                full[rows[vector_id]] = self._normalize(np.asarray(values, dtype=np.float32))
+                metadata[rows[vector_id]] = vector_metadata
+
+            self._save(namespace, full, ids, metadata)
+
+    def query(self, vector, top_k, namespace, include_metadata=True):
+        with self._lock:
+            matrix, ids, metadata, _ = self._load(namespace)
+        if matrix is None or not ids:
+            return {"matches": []}
+
+        query = self._normalize(np.asarray(vector, dtype=np.float32))
+        # Tính trên float32 kể cả khi lưu float16 (numpy không có BLAS cho float16)
+        scores = np.asarray(matrix, dtype=np.float32) @ query
+
+        # Chỉ sắp xếp top_k phần tử thay vì toàn bộ
+        top_k = min(top_k, len(ids))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+
+        return {
+            "matches": [
+                {
+                    "id": ids[row],
+                    "score": float(scores[row]),
+                    "metadata": metadata[row] if include_metadata else {},
+                }
+                for row in top
+            ]
+        }
+
+    def delete(self, ids, namespace):
+        ids = set(ids)
+        if not ids:
+            return
+
+        with self._lock:
+            matrix, current_ids, metadata, _ = self._load(namespace)
+            if matrix is None:
+                return
+
+            keep = [row for row, vector_id in enumerate(current_ids) if vector_id not in ids]
+            self._save(
+                namespace,
+                np.asarray(matrix)[keep],
+                [current_ids[row] for row in keep],
+                [metadata[row] for row in keep],
+            )
+
+    def delete_namespace(self, namespace):
+        with self._lock:
+            self._namespaces.pop(namespace, None)
+            path = self._path(namespace)
+            try:
+                os.remove(os.path.join(path, "CURRENT"))
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def create_vector_store():
+    """
+    Builds the vector store selected by VECTOR_BACKEND ("pinecone" or "local").
+    """
+    backend = os.getenv("VECTOR_BACKEND", "pinecone")
+
+    if backend == "local":
+        return LocalVectorStore(
+            os.getenv("LOCAL_VECTOR_DIR", os.path.join("cache", "vectors")),
+            dtype=os.getenv("LOCAL_VECTOR_DTYPE", "float32"),
+        )
+
+    from pinecone import Pinecone
+
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"), environment="us-east-1")
+    return PineconeVectorStore(
+        pc.Index(os.getenv("PINECONE_INDEX_NAME")),
+        batch_size=int(os.getenv("UPSERT_BATCH_SIZE", 100)),
+    )
@@ -1,34 +1,151 @@
 import os
 from dotenv import load_dotenv
-from pymongo import MongoClient
 import re
-from langchain_community.document_loaders import PyPDFLoader
-from PIL import Image
-import pytesseract, fitz, camelot, io
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from src.QAGenerator import generate_question_from_chunks
+from src.QAGenerator import generate_question_from_chunks, generate_questions_concurrently, quiz_concurrency
+from src.PdfExtractor import iter_pdf_pages, extract_pdf, fingerprint_pages
+from src.JobQueue import JobQueue, NullJob
+from src.Cache import LRUCache, DiskCache, content_hash
+from src.Storage import BlobStore, UploadTooLarge
+from src.Database import create_client, LazyCollection
+from src.Compute import compute, ComputePool
+from src.VectorStore import create_vector_store
+from src.Resources import resources
+from src.Translation import DocumentTranslator
+from src.Chunker import TokenChunker
+from src.Retrieval import KeywordIndex, HybridRetriever
+from src.Metrics import metrics
 from passlib.context import CryptContext
 import jwt
 from datetime import datetime, timedelta
 from bson import ObjectId
-from googletrans import Translator
-from langdetect import detect
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
 
 load_dotenv()
 
-# Pytesseract config
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# Các client và model nặng chỉ được tạo khi dùng lần đầu (hoặc khi warm-up lúc khởi động)
 
-# Pinecone
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"), environment="us-east-1")
-index_name = os.getenv("PINECONE_INDEX_NAME")
-pinecone_index = pc.Index(index_name)
+# Vector index: Pinecone hoặc index cục bộ, chọn bằng VECTOR_BACKEND
+vector_index = resources.register("vector_store", create_vector_store)
+
+def get_vector_store():
+    return vector_index.get()
+
+# Index BM25 theo namespace, tạo lúc ingest để tìm chính xác theo từ khóa (công thức, tên, định danh)
+keyword_index = KeywordIndex(os.getenv("KEYWORD_INDEX_DIR", os.path.join("cache", "keywords")))
+
+# Tìm kiếm kết hợp vector + BM25, bỏ kết quả điểm thấp và đoạn gần trùng
+retriever = HybridRetriever(
+    get_vector_store,
+    keyword_index,
+    candidates=int(os.getenv("RETRIEVAL_CANDIDATES", 20)),
+    min_vector_score=float(os.getenv("RETRIEVAL_MIN_VECTOR_SCORE", 0.2)),
+    min_keyword_score=float(os.getenv("RETRIEVAL_MIN_KEYWORD_SCORE", 1.0)),
+    dedup_threshold=float(os.getenv("RETRIEVAL_DEDUP_THRESHOLD", 0.8)),
+)
 
 # Embedding model
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+embedding_model_name = 'all-MiniLM-L6-v2'
+
+def load_embedding_model():
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(embedding_model_name)
+
+embedding_model = resources.register("embedding_model", load_embedding_model)
+
+def get_embedding_model():
+    return embedding_model.get()
+
+# Chia chunk theo token của tokenizer embedding: 0 = theo giới hạn đầu vào của model
+chunk_max_tokens = int(os.getenv("CHUNK_MAX_TOKENS", 0))
+chunk_overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
+
+def load_chunker():
+    model = get_embedding_model()
+    # Chừa chỗ cho token đặc biệt ([CLS], [SEP]) model tự thêm vào
+    max_tokens = chunk_max_tokens or model.max_seq_length - 2
+    return TokenChunker(model.tokenizer, max_tokens, chunk_overlap_tokens)
+
+chunker = resources.register("chunker", load_chunker)
+
+# Cache kết quả xử lý phụ thuộc cả model lẫn cách chia chunk
+chat_processed_kind = f"chat:{embedding_model_name}:{chunk_max_tokens}:{chunk_overlap_tokens}"
+
+# Translator dùng chung cho mọi lần dịch
+def load_translator():
+    from googletrans import Translator
+
+    return Translator()
+
+translator = resources.register("translator", load_translator)
+
+# Kích thước batch khi encode và upsert vector
+embed_batch_size = int(os.getenv("EMBED_BATCH_SIZE", 64))
+upsert_batch_size = int(os.getenv("UPSERT_BATCH_SIZE", 100))
+upsert_concurrency = int(os.getenv("UPSERT_CONCURRENCY", 4))
+
+# Cache 2 tầng cho chat: câu hỏi -> embedding và (namespace, câu hỏi, chunk) -> câu trả lời
+query_embedding_cache = LRUCache(maxsize=int(os.getenv("QUERY_CACHE_SIZE", 1024)))
+answer_cache = LRUCache(
+    maxsize=int(os.getenv("ANSWER_CACHE_SIZE", 512)),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", 3600)),
+)
+
+def normalize_query(query):
+    # Model embedding không phân biệt hoa thường, chỉ cần gộp khoảng trắng
+    return " ".join(query.lower().split())
+
+def embed_query(query):
+    key = normalize_query(query)
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        with metrics.span("embed_query"):
+            embedding = get_embedding_model().encode(query).tolist()
+        query_embedding_cache.set(key, embedding)
+    return embedding
+
+async def answer_cache_key(namespace, query, chunk_ids):
+    """
+    Key of a cached chat answer. It includes the namespace version (the time the PDF was
+    last ingested, from chat_pages), so answers cached by any process stop matching once
+    the PDF is re-ingested elsewhere.
+    """
+    state = await chat_pages_collection.find_one({"_id": namespace}, {"updated_at": 1})
+    version = state["updated_at"] if state else None
+    return (namespace, version, normalize_query(query), tuple(chunk_ids))
+
+# Xóa câu trả lời đã cache của một PDF khi PDF được xử lý lại trong process này
+def invalidate_namespace(namespace):
+    answer_cache.discard_where(lambda key: key[0] == namespace)
+
+# Encode nhiều đoạn văn bản theo batch
+@metrics.span("embed")
+def embed_texts(texts):
+    if not texts:
+        return []
+    metrics.inc("embedded_texts", len(texts))
+    return get_embedding_model().encode(texts, batch_size=embed_batch_size).tolist()
+
+# Upsert vector theo batch, nhiều batch chạy song song
+@metrics.span("vector_upsert")
+def upsert_vectors(vectors, namespace):
+    metrics.inc("vectors_upserted", len(vectors))
+    vector_store = get_vector_store()
+    batch_size = vector_store.batch_size or max(1, len(vectors))
+    batches = [vectors[i:i + batch_size] for i in range(0, len(vectors), batch_size)]
+
+    def upsert_batch(batch):
+        vector_store.upsert(batch, namespace=namespace)
+
+    if upsert_concurrency <= 1 or len(batches) <= 1:
+        for batch in batches:
+            upsert_batch(batch)
+    else:
+        with ThreadPoolExecutor(max_workers=upsert_concurrency) as pool:
+            list(pool.map(upsert_batch, batches))
 
 def clean_text(text):
     # Loại bỏ các ký tự không mong muốn, như chuỗi '.' dài
@@ -43,14 +160,28 @@ def clean_text(text):
     # Loại bỏ khoảng trắng đầu và cuối
     return text.strip()
 
-# Băm password
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Băm password: số vòng bcrypt chỉnh qua BCRYPT_ROUNDS, hash có số vòng khác sẽ được băm lại khi đăng nhập
+bcrypt_rounds = int(os.getenv("BCRYPT_ROUNDS", 12))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=bcrypt_rounds,
+    bcrypt__min_rounds=bcrypt_rounds,
+    bcrypt__max_rounds=bcrypt_rounds,
+)
+
+# Pool riêng cho bcrypt để đợt đăng nhập đông không chặn event loop và không tranh worker với xử lý PDF
+password_pool = ComputePool(thread_workers=int(os.getenv("PASSWORD_HASH_WORKERS", 4)), process_workers=1)
+
+async def hash_password(password):
+    return await password_pool.run_blocking(pwd_context.hash, password)
 
-def hash_password(password):
-    return pwd_context.hash(password)
+# Trả về (đúng mật khẩu, hash mới nếu cần băm lại hoặc None)
+async def verify_and_update_password(password, hashed_password):
+    return await password_pool.run_blocking(pwd_context.verify_and_update, password, hashed_password)
 
-def verify_password(password, hashed_password):
-    return pwd_context.verify(password, hashed_password)
+def password_hashing_stats():
+    return {"bcrypt_rounds": bcrypt_rounds, **password_pool.stats()["threads"]}
 
 # JWT token handling
 jwt_secret = os.getenv("JWT_SECRET")
@@ -79,62 +210,90 @@ def decode_jwt(token: str):
     except jwt.InvalidTokenError:
         return None
 
-# Kết nối tới MongoDB Cloud
-client = MongoClient(os.getenv('MONGO_URI'))
-db = client.get_database() 
-users_collection = db.users
-quizzes_collection = db.quizzes 
-
-# Ảnh sang text
-def extract_text_from_image(file_path):
-    doc = fitz.open(file_path)
-    image_text = []
-    page_text = ""
-    img_count = 1
-
-    for page_number in range(len(doc)):
-        page = doc[page_number]
-        images = page.get_images(full=True)
-
-        for img in images:
-            xref = img[0]
-
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-
-            image = Image.open(io.BytesIO(image_bytes))
-
-            page_text += f"(Image {img_count}):\n"
-            page_text += pytesseract.image_to_string(image)
-            img_count += 1
-
-        if page_text.strip():
-            image_text.append({"text": page_text, "page_number": page_number + 1})
-
-    return image_text
-
-# Bảng sang text
-def extract_text_from_table(file_path):
-    tables = camelot.read_pdf(file_path, pages="all")
-    table_text = []
-    table_count = 1
-
-    for table in tables:
-        page_number = table.page
-        table_text.append({"text": f"(Table {table_count}):\n" + table.df.to_string(), "page_number": page_number})
-        table_count += 1
+# Kết nối tới MongoDB Cloud (client được tạo ở lần truy vấn đầu tiên)
+mongo_client = resources.register("mongo", create_client)
+users_collection = LazyCollection(mongo_client, "users")
+quizzes_collection = LazyCollection(mongo_client, "quizzes")
+jobs_collection = LazyCollection(mongo_client, "jobs")
+
+uploads_collection = LazyCollection(mongo_client, "uploads")
+attempts_collection = LazyCollection(mongo_client, "attempts")
+quiz_stats_collection = LazyCollection(mongo_client, "quiz_stats")
+# Dấu vân tay và số chunk của từng trang trong mỗi namespace chat, để lần xử lý sau chỉ làm lại trang thay đổi
+chat_pages_collection = LazyCollection(mongo_client, "chat_pages")
+
+# Cache document user theo username để không phải truy vấn lại ở mỗi request
+user_cache = LRUCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("USER_CACHE_TTL", 30)),
+)
+
+async def get_user(username):
+    user = user_cache.get(username)
+    if user is None:
+        user = await users_collection.find_one({"username": username})
+        # Không cache user chưa tồn tại để đăng ký xong dùng được ngay
+        if user:
+            user_cache.set(username, user)
+    return user
+
+# Gọi sau mỗi lần ghi vào document của user
+def invalidate_user(username):
+    user_cache.delete(username)
+
+# Tạo các index hỗ trợ truy vấn (không làm gì nếu index đã tồn tại)
+async def ensure_indexes():
+    await users_collection.create_index("username")
+    await quizzes_collection.create_index("quiz_name")
+    await uploads_collection.create_index([("username", 1), ("filename", 1)])
+    await jobs_collection.create_index([("status", 1), ("lease_until", 1)])
+    await attempts_collection.create_index([("quiz_id", 1), ("username", 1), ("time", -1), ("_id", -1)])
+
+# Lưu file upload theo nội dung (sha256): mỗi file chỉ lưu một lần
+blob_store = BlobStore(os.getenv("BLOB_DIR", os.path.join("static", "blobs")))
+upload_chunk_size = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+max_upload_size = int(os.getenv("MAX_UPLOAD_SIZE", 200 * 1024 * 1024))
+
+# Chunk và embedding của từng trang theo dấu vân tay: trang giống nhau (kể cả ở PDF khác) chỉ xử lý một lần
+page_cache = DiskCache(
+    os.getenv("PAGE_CACHE_DIR", os.path.join("cache", "pages")),
+    max_entries=int(os.getenv("PAGE_CACHE_SIZE", 100000)),
+)
+
+def page_key(fingerprint):
+    return content_hash(f"{fingerprint}:{chat_processed_kind}")
+
+# Lưu file upload của người dùng: file được lưu một lần theo hash, đường dẫn của user trỏ tới file đó
+async def save_upload(file, username):
+    sha256, _, size = await blob_store.save_upload(file, chunk_size=upload_chunk_size, max_size=max_upload_size)
+
+    file_location = os.path.join("static", username, file.filename)
+    # Tạo link (hoặc copy nếu không hỗ trợ hard link) trên thread pool để không chặn event loop
+    await compute.run_blocking(blob_store.link, sha256, file_location)
+
+    await uploads_collection.update_one(
+        {"username": username, "filename": file.filename},
+        {"$set": {"sha256": sha256, "size": size, "uploaded_at": datetime.utcnow()}},
+        upsert=True
+    )
+    return file_location, sha256
 
-    return table_text
+# Hàng đợi xử lý PDF chạy nền, trạng thái job lưu trong MongoDB
+job_queue = JobQueue(
+    jobs_collection,
+    workers=int(os.getenv("JOB_WORKERS", 2)),
+    work_dir=os.getenv("JOB_WORK_DIR", os.path.join("cache", "jobs")),
+)
 
 # Xử lý PDF để tạo quiz
+@metrics.span("extract", pipeline="quiz")
 def file_processing_quiz(file_path):
-    loader = PyPDFLoader(file_path)
-    data = loader.load()
-
     question_gen = ""
 
-    for page in data:
-        question_gen += page.page_content
+    # Chỉ cần văn bản, bỏ qua OCR ảnh và bảng
+    for page in iter_pdf_pages(file_path, images=False, tables=False):
+        question_gen += page["text"]
+        metrics.inc("pdf_pages")
 
     # Loại bỏ xuống dòng không cần thiết trong đoạn văn
     question_gen = re.sub(r"(?<!\n)\n(?!\n)", " ", question_gen)
@@ -156,43 +315,28 @@ def file_processing_quiz(file_path):
     return document_ques_gen    
 
 # Xử lý PDF cho chatbot
-def file_processing_chat(file_path):
-    loader = PyPDFLoader(file_path)
-    data = loader.load()
-
+@metrics.span("extract", pipeline="chat")
+def file_processing_chat(file_path, pages=None):
     document_ques_gen = []
 
-    # Trích xuất văn bản từ ảnh
-    image_text = extract_text_from_image(file_path)
-
-    # Trích xuất văn bản từ bảng
-    table_text = extract_text_from_table(file_path)
-
-    page_number = 1
-
-    # Duyệt qua từng trang của PDF
-    for page in data:
-        page_content = page.page_content
+    # Chỉ chia để gửi dịch, các đoạn được ghép lại theo trang trước khi chia chunk nên không cần overlap
+    splitter_ques_gen = RecursiveCharacterTextSplitter(
+        chunk_size=5012,
+        chunk_overlap=0
+    )
 
-        # Gắn text từ image ở trang hiện tại
-        for img_text in image_text:
-            if img_text["page_number"] == page_number:
-                page_content += "\n" + img_text["text"]
+    # Đọc PDF một lượt: văn bản, ảnh và bảng của từng trang (hoặc chỉ các trang được chọn)
+    for page in extract_pdf(file_path, pages=pages).values():
+        page_number = page["page_number"]
 
-        # Gắn text từ bảng ở trang hiện tại
-        for tab_text in table_text:
-            if tab_text["page_number"] == page_number:
-                page_content += "\n" + tab_text["text"] 
+        # Gắn text từ image và bảng ở trang hiện tại
+        page_content = "\n".join([page["text"]] + page["images"] + page["tables"])
         
         # Xử lý văn bản
         page_content = re.sub(r"(?<!\n)\n(?!\n)", " ", page_content)
         page_content = re.sub(r"(\n{2,})", "\n\n", page_content)
         page_content = re.sub(r"(?<=\w)-\s+", "", page_content)
 
-        splitter_ques_gen = RecursiveCharacterTextSplitter(
-            chunk_size=5012,
-            chunk_overlap=200
-        )
         chunks = splitter_ques_gen.split_text(page_content)
 
         for chunk in chunks:
@@ -202,96 +346,299 @@ def file_processing_chat(file_path):
             )
             document_ques_gen.append(doc)
 
-        page_number += 1
-
     return document_ques_gen
 
-#Chuyển text qua tiếng anh
-async def translate_text(document_ques_gen):
-    translator = Translator()
-    
-    # Phát hiện ngôn ngữ của văn bản
-    detected_lang = detect(document_ques_gen)
-    
-    # Nếu ngôn ngữ là tiếng Việt, tiến hành dịch sang tiếng Anh
-    if detected_lang == 'vi':
-        translated_text = await translator.translate(document_ques_gen, src='vi', dest='en')
-        return translated_text.text
-    else:
-        # Nếu ngôn ngữ không phải là tiếng Việt, trả về văn bản gốc
-        return document_ques_gen
+# Dịch tiếng Việt sang tiếng Anh: phát hiện ngôn ngữ một lần cho cả tài liệu, gộp nhiều đoạn vào một request
+document_translator = DocumentTranslator(
+    translator.get,
+    DiskCache(
+        os.getenv("TRANSLATION_CACHE_DIR", os.path.join("cache", "translations")),
+        max_entries=int(os.getenv("TRANSLATION_CACHE_SIZE", 100000)),
+    ),
+    max_chars=int(os.getenv("TRANSLATION_MAX_CHARS", 4500)),
+    concurrency=int(os.getenv("TRANSLATION_CONCURRENCY", 4)),
+)
 
-async def translate_documents_quiz(documents):
-    # Lặp qua từng document và dịch nội dung
-    translated_documents = []
-    
-    for document in documents:
-        page_content = document.page_content  # Lấy nội dung trang
-        translated_text = await translate_text(page_content)  # Dịch nội dung trang
-        translated_documents.append(translated_text)  # Lưu kết quả dịch vào danh sách
-    
-    return translated_documents
+async def translate_texts(texts, job=None):
+    job = job or NullJob()
+    checkpoint = await job.checkpoint("translate", total=len(texts))
+
+    # Bỏ qua các đoạn đã dịch trước đó
+    translated = {i: checkpoint.get(i) for i in range(len(texts)) if i in checkpoint}
+    pending = [i for i in range(len(texts)) if i not in translated]
+
+    async def on_result(index, text):
+        await checkpoint.save(pending[index], text)
+
+    metrics.inc("translated_chunks", len(pending))
+    with metrics.span("translate"):
+        results = await document_translator.translate_many([texts[i] for i in pending], on_result=on_result)
+    translated.update(zip(pending, results))
+
+    await checkpoint.finish()
+    return [translated[i] for i in range(len(texts))]
+
+async def translate_documents_quiz(documents, job=None):
+    return await translate_texts(documents, job)
 
 #Chuyển doc qua tiếng anh
-async def translate_documents_chat(documents):
-    # Lặp qua từng document và dịch nội dung
-    translated_documents = []
-    
-    for document in documents:
-        page_content = document.page_content  # Lấy nội dung trang
-        translated_text = await translate_text(page_content)  # Dịch nội dung trang
-        # translated_documents.append(translated_text)  # Lưu kết quả dịch vào danh sách
-        translated_documents.append({
+async def translate_documents_chat(documents, job=None):
+    translated_texts = await translate_texts([document["page_content"] for document in documents], job)
+    return [
+        {
             'page_content': translated_text,
-            'page_number': document.metadata.get("page_number", None)
-        })
-    
+            'page_number': document["page_number"]
+        }
+        for document, translated_text in zip(documents, translated_texts)
+    ]
+
+async def process_and_translate_chat(file_path, job=None, pages=None):
+    job = job or NullJob()
+    # Trích xuất PDF chạy trên thread pool để không chặn event loop
+    document_ques_gen = await job.run_stage("extract", lambda: compute.run_blocking(lambda: [
+        {"page_content": doc.page_content, "page_number": doc.metadata["page_number"]}
+        for doc in file_processing_chat(file_path, pages)
+    ]))
+    translated_documents = await translate_documents_chat(document_ques_gen, job)
     return translated_documents
 
-async def process_and_translate_chat(file_path):
-    document_ques_gen = file_processing_chat(file_path) 
-    translated_documents = await translate_documents_chat(document_ques_gen)
-    return translated_documents
+# Chia văn bản đã dịch của từng trang thành các cửa sổ token vừa với đầu vào của model embedding
+@metrics.span("chunk")
+def chunk_documents(documents):
+    pages = {}
+    for doc in documents:
+        pages.setdefault(doc["page_number"], []).append(doc["page_content"])
+
+    chunks = []
+    for page_number, texts in pages.items():
+        for window in chunker.get().split("\n".join(texts)):
+            chunks.append({**window, "page_number": page_number})
+    metrics.inc("chunks", len(chunks))
+    return chunks
+
+def convert_to_ascii(input_string):
+    return unicodedata.normalize('NFKD', input_string).encode('ascii', 'ignore').decode('utf-8')
+
+# Id gồm số trang: sửa một trang chỉ ghi đè hoặc xóa các chunk của trang đó
+def chunk_id(user, ascii_filename, page_number, index):
+    return f"{user["username"]}_{ascii_filename}_{page_number}_{index}"
+
+def chunk_metadata(chunk):
+    return {
+        "metadata": f"Page {chunk["page_number"]} :" + chunk["text"],
+        "page_number": chunk["page_number"],
+        "start": chunk["start"],
+        "end": chunk["end"],
+    }
+
+# So sánh dấu vân tay các trang với lần xử lý trước của namespace
+async def plan_chat_ingest(file_path, namespace):
+    fingerprints = await compute.run_blocking(fingerprint_pages, file_path)
+    state = await chat_pages_collection.find_one({"_id": namespace})
+    previous = state["pages"] if state else {}
+
+    plan = {"pages": {}, "process": [], "reuse": [], "previous": previous, "has_state": state is not None}
+    for page_number, fingerprint in fingerprints.items():
+        page = str(page_number)
+        # So sánh theo page_key (gồm cả model và cách chia chunk): đổi cấu hình thì trang được xử lý lại
+        key = page_key(fingerprint)
+        plan["pages"][page] = key
+        if previous.get(page, {}).get("fingerprint") == key:
+            continue
+        # Trang mới, bị sửa hoặc đổi vị trí: dùng lại kết quả nếu nội dung trang đã từng được xử lý
+        if page_cache.get(key) is not None:
+            plan["reuse"].append(page)
+        else:
+            plan["process"].append(page)
+    return plan
+
+# Xử lý PDF cho chatbot: trích xuất, dịch, embedding và lưu vào Pinecone, chỉ với các trang thay đổi
+async def ingest_pdf_chat(file_path, ascii_filename, user, job=None):
+    job = job or NullJob()
+    namespace = f"{user["username"]}.{ascii_filename}"
+
+    # Kế hoạch được lưu như một stage để job chạy lại dùng đúng danh sách trang ban đầu
+    plan = await job.run_stage("plan", plan_chat_ingest, file_path, namespace)
+    previous = plan["previous"]
+
+    # PDF đã xử lý trước khi có dấu vân tay trang: id cũ không theo trang nên xóa cả namespace
+    if not plan["has_state"] and ascii_filename in user.get("pdfs_chat", []):
+        async def drop_namespace():
+            await compute.run_blocking(get_vector_store().delete_namespace, namespace)
+            await compute.run_blocking(keyword_index.delete_namespace, namespace)
+        await job.run_stage("drop_legacy", drop_namespace)
+
+    # Chỉ trích xuất, OCR, dịch và chia chunk các trang chưa từng xử lý
+    chunks = []
+    if plan["process"]:
+        processed_documents = await process_and_translate_chat(file_path, job, {int(page) for page in plan["process"]})
+        chunks = await job.run_stage("chunk", lambda: compute.run_blocking(chunk_documents, processed_documents))
+
+    page_chunks = {page: [] for page in plan["process"]}
+    for chunk in chunks:
+        page_chunks[str(chunk["page_number"])].append(chunk)
+
+    # Trang đã có trong cache: lấy sẵn chunk và embedding, chỉ cập nhật số trang
+    for page in plan["reuse"]:
+        cached = page_cache.get(plan["pages"][page])
+        if cached is None:
+            raise RuntimeError(f"Kết quả của trang {page} đã bị xóa khỏi cache, hãy xử lý lại")
+        page_chunks[page] = [
+            {**chunk, "page_number": int(page), "embedding": embedding}
+            for chunk, embedding in zip(cached["chunks"], cached["embeddings"])
+        ]
+
+    changed = []
+    for page in sorted(page_chunks, key=int):
+        for i, chunk in enumerate(page_chunks[page]):
+            chunk["id"] = chunk_id(user, ascii_filename, page, i)
+            changed.append(chunk)
+
+    # Encode theo batch rồi upsert hàng loạt, ghi nhận từng nhóm đã xong để có thể chạy tiếp
+    checkpoint = await job.checkpoint("embed", total=len(changed))
+    group_size = upsert_batch_size * max(1, upsert_concurrency)
+    keyword_documents = []
+
+    for start in range(0, len(changed), group_size):
+        group = changed[start:start + group_size]
+        embeddings = checkpoint.get(start)
+
+        if embeddings is None:
+            missing = [chunk["text"] for chunk in group if "embedding" not in chunk]
+            new_embeddings = iter(await compute.run_blocking(embed_texts, missing))
+            embeddings = [chunk["embedding"] if "embedding" in chunk else next(new_embeddings) for chunk in group]
+
+            vectors = [
+                (chunk["id"], embedding, chunk_metadata(chunk))
+                for chunk, embedding in zip(group, embeddings)
+            ]
+            await compute.run_blocking(upsert_vectors, vectors, namespace=namespace)
+            await checkpoint.save(start, embeddings)
+
+        for chunk, embedding in zip(group, embeddings):
+            chunk["embedding"] = embedding
+        keyword_documents += [(chunk["id"], chunk["text"], chunk_metadata(chunk)) for chunk in group]
+
+    with metrics.span("keyword_index"):
+        await compute.run_blocking(keyword_index.upsert, keyword_documents, namespace=namespace)
+
+    # Chunk của trang bị xóa, hoặc phần thừa khi trang mới có ít chunk hơn
+    chunk_counts = {
+        page: previous[page]["chunks"] if page not in page_chunks else len(page_chunks[page])
+        for page in plan["pages"]
+    }
+    stale_ids = [
+        chunk_id(user, ascii_filename, page, i)
+        for page, state in previous.items()
+        for i in range(chunk_counts.get(page, 0), state["chunks"])
+    ]
+    if stale_ids:
+        await compute.run_blocking(get_vector_store().delete, stale_ids, namespace=namespace)
+        await compute.run_blocking(keyword_index.delete, stale_ids, namespace=namespace)
+
+    await checkpoint.finish()
+    invalidate_namespace(namespace)
+
+    for page in plan["process"]:
+        page_cache.set(plan["pages"][page], {
+            "chunks": [{k: chunk[k] for k in ("text", "start", "end")} for chunk in page_chunks[page]],
+            "embeddings": [chunk["embedding"] for chunk in page_chunks[page]],
+        })
+
+    await chat_pages_collection.update_one(
+        {"_id": namespace},
+        {"$set": {
+            "pages": {page: {"fingerprint": plan["pages"][page], "chunks": chunk_counts[page]} for page in plan["pages"]},
+            "updated_at": datetime.utcnow(),
+        }},
+        upsert=True
+    )
+
+    metrics.inc("pages_processed", len(plan["process"]))
+    metrics.inc("pages_reused", len(plan["reuse"]))
+    metrics.inc("chunks_deleted", len(stale_ids))
+
+    # Lưu tên PDF vào users.collection
+    await users_collection.update_one(
+        {"username": user["username"]},
+        {"$addToSet": {"pdfs_chat": ascii_filename}},
+        upsert=True
+    )
+    invalidate_user(user["username"])
+    return {
+        "pdf": ascii_filename,
+        "pages": len(plan["pages"]),
+        "processed_pages": len(plan["process"]),
+        "reused_pages": len(plan["reuse"]),
+        "chunks": sum(chunk_counts.values()),
+        "deleted_chunks": len(stale_ids),
+    }
+
+async def llm_pipeline_quiz(file_path, job=None, fresh=False):
+    job = job or NullJob()
+    document_ques_gen = await job.run_stage("extract", lambda: compute.run_blocking(lambda: [
+        doc.page_content for doc in file_processing_quiz(file_path)
+    ]))
+    translated_documents = await translate_documents_quiz(document_ques_gen, job)
+
+    # Các chunk đã sinh câu hỏi ở lần chạy trước được giữ lại
+    checkpoint = await job.checkpoint("generate", total=len(translated_documents))
+    pending = [i for i in range(len(translated_documents)) if i not in checkpoint]
+
+    # Thêm các chunk vào model để xử lí, song song nếu QUIZ_CONCURRENCY > 1
+    with metrics.span("generate"):
+        if quiz_concurrency > 1:
+            async def on_result(index, quiz):
+                await checkpoint.save(pending[index], quiz)
+
+            await generate_questions_concurrently([translated_documents[i] for i in pending], on_result=on_result, fresh=fresh)
+        else:
+            for i in pending:
+                await checkpoint.save(i, await compute.run_blocking(generate_question_from_chunks, translated_documents[i], fresh))
+
+    await checkpoint.finish()
 
-async def llm_pipeline_quiz(file_path):
-    document_ques_gen = file_processing_quiz(file_path) 
-    translated_documents = await translate_documents_quiz(document_ques_gen)
-    # Thêm từng chunk vào model để xử lí
     quiz_from_chunk = []
-    for text in translated_documents:
-        quiz = generate_question_from_chunks(text)
-        quiz_from_chunk += quiz
+    for i in range(len(translated_documents)):
+        quiz = checkpoint.get(i)
+        # Bỏ qua các chunk bị lỗi (trả về chuỗi thông báo lỗi)
+        if isinstance(quiz, list):
+            quiz_from_chunk += quiz
+        else:
+            metrics.inc("quiz_chunk_failures")
+    metrics.inc("questions_generated", len(quiz_from_chunk))
     return quiz_from_chunk
 
 # Lưu quiz vào MongoDB
-def save_to_mongo(quiz_data, quiz_name, user):
+async def save_to_mongo(quiz_data, quiz_name, user):
     # Giả sử user.get("quizzes", []) trả về danh sách các chuỗi
     quiz_ids = [ObjectId(id_str) for id_str in user.get("quizzes", [])]
 
     # Tìm quiz theo tên quiz và thuộc quyền sở hữu của người dùng
-    existing_quiz = quizzes_collection.find_one({"quiz_name": quiz_name, "_id": {"$in": quiz_ids}})
+    existing_quiz = await quizzes_collection.find_one({"quiz_name": quiz_name, "_id": {"$in": quiz_ids}})
 
     # Kiểm tra xem quiz đã tồn tại chưa, nếu tồn tại thì update, nếu không thì insert
     if existing_quiz:
-        quizzes_collection.update_one(
+        await quizzes_collection.update_one(
             {"_id": existing_quiz["_id"], "quiz_name": quiz_name},
             {"$set": {"questions": quiz_data}},
         )
     else:
-        result = quizzes_collection.insert_one({
+        result = await quizzes_collection.insert_one({
             "quiz_name": quiz_name,
             "questions": quiz_data
         })  
         id = str(result.inserted_id)
 
-        users_collection.update_one(
+        await users_collection.update_one(
             {"username": user["username"]},
             {"$push": {"quizzes": id}}
         )
+        invalidate_user(user["username"])
 
 # Save questions to quiz
-async def save_quiz(file_path, user):
-    ques_list = await llm_pipeline_quiz(file_path)  # Await the LLM pipeline
+async def save_quiz(file_path, user, job=None, fresh=False):
+    ques_list = await llm_pipeline_quiz(file_path, job, fresh)  # Await the LLM pipeline
     
     # Convert questions into quiz format
     quiz_data = []
@@ -306,6 +653,7 @@ async def save_quiz(file_path, user):
     quiz_name = os.path.splitext(os.path.basename(file_path))[0]
     
     # Save the quiz to MongoDB (including all questions)
-    save_to_mongo(quiz_data, quiz_name, user)
+    await save_to_mongo(quiz_data, quiz_name, user)
+    return {"quiz_name": quiz_name, "questions": len(quiz_data)}
 
 
@@ -13,6 +13,22 @@ const Upload = ({ onUploadSuccess }) => {
     setFilename(file.name);
   };
 
+  // Chờ job xử lý PDF chạy nền hoàn tất
+  const waitForJob = async (jobId, token) => {
+    while (true) {
+      const response = await axios.get(`http://localhost:8000/jobs/${jobId}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (response.data.status === "done") {
+        return response.data;
+      }
+      if (response.data.status === "failed") {
+        throw new Error(response.data.error);
+      }
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+  };
+
   const handleSubmit = async (e, action) => {
     e.preventDefault();
     setLoading(true);
@@ -41,6 +57,7 @@ const Upload = ({ onUploadSuccess }) => {
             },
           });
           if (processResponse) {
+            await waitForJob(processResponse.data.job_id, token);
             alert("Tạo quiz thành công!");
             onUploadSuccess();
           }
@@ -53,6 +70,7 @@ const Upload = ({ onUploadSuccess }) => {
             });
 
             if(chatResponse) {
+              await waitForJob(chatResponse.data.job_id, token);
               alert("Lưu vào chat thành công!");
               onUploadSuccess();
           }